@@ -1,6 +1,13 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, session, send_file
+from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, session, send_file, has_request_context
 from config.database import db
 from datetime import datetime, timedelta
+from decimal import Decimal
+import archivo_llamadas
+import importacion_contactos
+import saldo_prepago
+import captura_trafico
+from tarificacion import (determinar_tipo_destino, calcular_pulsos,
+                          DURACION_PULSO_DEFECTO, REDONDEO_DEFECTO)
 import hashlib
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -17,6 +24,12 @@ app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 app.jinja_env.auto_reload = True
 
+# Read-your-writes: tras escribir, las lecturas de esta sesión van al primario unos segundos
+db.sesion = lambda: session if has_request_context() else None
+
+# Captura opcional de tráfico para pruebas de carga (activar con CAPTURA_TRAFICO=ruta.jsonl)
+captura_trafico.instalar(app)
+
 # Función para hashear passwords
 def hash_password(password):
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
@@ -43,28 +56,6 @@ def login_required(role=None):
 # FUNCIONES AUXILIARES - SISTEMA DE PULSOS Y PERIODOS
 # =============================================
 
-# Función para determinar tipo de destino
-def determinar_tipo_destino(numero_destino):
-    if not numero_destino:
-        return 'convencional'
-    
-    numero_limpio = str(numero_destino).strip()
-    
-    # Internacional
-    if numero_limpio.startswith('+'):
-        return 'internacional'
-    
-    # Celular (8 dígitos que empiezan con 5,7,8)
-    if len(numero_limpio) == 8 and numero_limpio[0] in ['5', '7', '8']:
-        return 'celular'
-    
-    # Convencional (8 dígitos que no empiezan con 5,7,8)
-    if len(numero_limpio) == 8:
-        return 'convencional'
-    
-    # Por defecto
-    return 'convencional'
-
 # Función simplificada para calcular costo (como fallback)
 def calcular_costo_simplificado(numero_destino, duracion_minutos):
     tipo_destino = determinar_tipo_destino(numero_destino)
@@ -90,16 +81,11 @@ def calcular_costo_con_pulsos(numero_origen, numero_destino, duracion_segundos):
             redondeo = bool(config_pulso[0]['redondeo_pulso'])
         else:
             # Valores por defecto
-            duracion_pulso = 60
-            redondeo = True
+            duracion_pulso = DURACION_PULSO_DEFECTO
+            redondeo = REDONDEO_DEFECTO
         
         # Calcular número de pulsos
-        if redondeo:
-            # Redondear hacia arriba (ej: 61 segundos = 2 pulsos)
-            pulsos = (duracion_segundos + duracion_pulso - 1) // duracion_pulso
-        else:
-            # Redondear hacia abajo
-            pulsos = duracion_segundos // duracion_pulso
+        pulsos = calcular_pulsos(duracion_segundos, duracion_pulso, redondeo)
         
         # Obtener tarifa por pulso
         tipo_origen = determinar_tipo_destino(numero_origen)
@@ -245,13 +231,13 @@ def dashboard():
         periodo_actual = obtener_o_crear_periodo_actual()
         
         # Estadísticas
-        total_contactos_result = db.execute_query("SELECT COUNT(*) as count FROM contactos")
+        total_contactos_result = db.execute_query("SELECT COUNT(*) as count FROM contactos", leer_replica=True)
         total_contactos = total_contactos_result[0]['count'] if total_contactos_result else 0
         
-        total_llamadas_result = db.execute_query("SELECT COUNT(*) as count FROM llamadas")
+        total_llamadas_result = db.execute_query("SELECT COUNT(*) as count FROM llamadas", leer_replica=True)
         total_llamadas = total_llamadas_result[0]['count'] if total_llamadas_result else 0
         
-        total_facturas_result = db.execute_query("SELECT COUNT(*) as count FROM facturas")
+        total_facturas_result = db.execute_query("SELECT COUNT(*) as count FROM facturas", leer_replica=True)
         total_facturas = total_facturas_result[0]['count'] if total_facturas_result else 0
         
         # Llamadas recientes
@@ -260,7 +246,7 @@ def dashboard():
             FROM llamadas l 
             JOIN contactos c ON l.contacto_origen_id = c.id 
             ORDER BY l.fecha_llamada DESC
-        """) or []
+        """, leer_replica=True) or []
         
         # Cargar contactos para el modal
         contactos = db.execute_query("""
@@ -268,7 +254,7 @@ def dashboard():
             FROM contactos c
             LEFT JOIN tipos_numero t ON c.tipo_numero_id = t.id
             ORDER BY c.nombre
-        """) or []
+        """, leer_replica=True) or []
         
         return render_template('dashboard.html',
                             total_contactos=total_contactos,
@@ -290,6 +276,7 @@ def dashboard():
 @app.route('/llamadas/simular', methods=['POST'])
 @login_required()
 def simular_llamada():
+    autorizacion = None
     try:
         contacto_origen_id = request.form.get('contacto_origen_id')
         numero_destino = request.form.get('numero_destino')
@@ -317,8 +304,22 @@ def simular_llamada():
         contacto = contacto_result[0]
         print(f"✅ Contacto encontrado: {contacto['nombre']}")
         
-        # ==== SISTEMA DE PULSOS - CÁLCULO MEJORADO ====
+        # ==== AUTORIZACIÓN PREPAGO / CRÉDITO ====
         duracion_segundos = duracion * 60
+        libro = saldo_prepago.obtener_libro()
+        autorizacion = libro.autorizar(
+            contacto_origen_id, contacto['numero'], numero_destino, duracion_segundos
+        )
+        if not autorizacion['autorizado']:
+            flash(f"❌ Llamada rechazada: {autorizacion['motivo']}", "danger")
+            return redirect(url_for('dashboard'))
+        
+        if autorizacion['segundos_autorizados'] is not None and autorizacion['segundos_autorizados'] < duracion_segundos:
+            # El saldo no alcanza: la llamada se corta al agotarse lo autorizado
+            duracion_segundos = autorizacion['segundos_autorizados']
+            flash(f"⚠️ Saldo insuficiente: llamada cortada a los {duracion_segundos} segundos", "warning")
+        
+        # ==== SISTEMA DE PULSOS - CÁLCULO MEJORADO ====
         costo_total, pulsos_consumidos = calcular_costo_con_pulsos(
             contacto['numero'], numero_destino, duracion_segundos
         )
@@ -345,6 +346,9 @@ def simular_llamada():
         print(f"📊 Resultado de inserción: {result}")
         
         if result is not None and result > 0:
+            # Cobrar al colgar los pulsos realmente consumidos
+            libro.confirmar(autorizacion['reserva_id'], duracion_segundos)
+            autorizacion = None
             flash(f"✅ Llamada registrada exitosamente! {pulsos_consumidos} pulsos, Costo: ${costo_total:.2f}", "success")
         else:
             flash("❌ Error: No se pudo insertar en la base de datos", "danger")
@@ -355,6 +359,10 @@ def simular_llamada():
         print(f"📝 Traceback: {traceback.format_exc()}")
         flash(f"❌ Error: {str(e)}", "danger")
     
+    # Llamada no registrada: devolver el saldo reservado
+    if autorizacion:
+        libro.liberar(autorizacion['reserva_id'])
+    
     return redirect(url_for('dashboard'))
 
 # Gestión de contactos
@@ -417,6 +425,33 @@ def guardar_contacto():
     
     return redirect(url_for('gestion_contactos'))
 
+# Importación masiva de contactos desde CSV
+@app.route('/contactos/importar', methods=['POST'])
+@login_required()
+def importar_contactos():
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        flash("Seleccione un archivo CSV", "danger")
+        return redirect(url_for('gestion_contactos'))
+    
+    try:
+        insertados, reporte = importacion_contactos.importar_csv(archivo.read())
+    except Exception as e:
+        flash(f"Error al leer el archivo: {str(e)}", "danger")
+        return redirect(url_for('gestion_contactos'))
+    
+    rechazados = len(reporte) - insertados
+    if rechazados == 0:
+        flash(f"✅ {insertados} contactos importados", "success")
+        return redirect(url_for('gestion_contactos'))
+    
+    # Devolver el reporte por fila para que el usuario corrija los rechazos
+    flash(f"Importación: {insertados} contactos importados, {rechazados} rechazados", "warning")
+    return send_file(BytesIO(importacion_contactos.reporte_csv(reporte).encode('utf-8-sig')),
+                     mimetype='text/csv',
+                     as_attachment=True,
+                     download_name='reporte_importacion_contactos.csv')
+
 @app.route('/contactos/eliminar/<int:contacto_id>')
 @login_required()
 def eliminar_contacto(contacto_id):
@@ -438,14 +473,14 @@ def gestion_facturacion():
     # Crear periodo actual automáticamente
     periodo_actual = obtener_o_crear_periodo_actual()
     
-    periodos = db.execute_query("SELECT * FROM periodos_facturacion ORDER BY fecha_inicio DESC") or []
+    periodos = db.execute_query("SELECT * FROM periodos_facturacion ORDER BY fecha_inicio DESC", leer_replica=True) or []
     facturas = db.execute_query("""
         SELECT f.*, c.nombre as contacto_nombre, p.nombre as periodo_nombre
         FROM facturas f
         JOIN contactos c ON f.contacto_id = c.id
         JOIN periodos_facturacion p ON f.periodo_id = p.id
         ORDER BY f.fecha_generacion DESC
-    """) or []
+    """, leer_replica=True) or []
     
     return render_template('facturacion.html',
                          periodos=periodos,
@@ -476,13 +511,29 @@ def generar_facturacion():
         print(f"📅 Periodo seleccionado: {periodo['nombre']} ({periodo['fecha_inicio']} a {periodo['fecha_fin']})")
         
         # CONSULTA SIMPLE Y EFECTIVA (como en tu versión que funciona)
-        llamadas_periodo = db.execute_query("""
+        # Mismo rango [fecha_inicio, fecha_fin + 1 día) que el archivo de periodos cerrados
+        # Los contactos prepago ya pagaron con su saldo y no se facturan
+        llamadas_periodo = db.execute_query(f"""
             SELECT contacto_origen_id, SUM(costo_total) as total
             FROM llamadas 
-            WHERE fecha_llamada >= ? AND fecha_llamada <= ?
+            WHERE {archivo_llamadas.PREDICADO_PERIODO} AND {saldo_prepago.EXCLUIR_PREPAGO}
             GROUP BY contacto_origen_id
             HAVING SUM(costo_total) > 0
-        """, (periodo['fecha_inicio'], periodo['fecha_fin']))
+        """, archivo_llamadas.rango_periodo(periodo))
+        
+        # Periodo ya purgado de SQL Server: sumar lo que quedó en el archivo columnar
+        archivo = archivo_llamadas.abrir_periodo(periodo_id)
+        if archivo and archivo.purgado:
+            prepago = saldo_prepago.contactos_prepago()
+            if prepago is None:
+                raise RuntimeError("No se pudieron leer las cuentas prepago")
+            totales = {l['contacto_origen_id']: l['total'] for l in (llamadas_periodo or [])}
+            for contacto_id, (_, centavos) in archivo.totales_por_contacto().items():
+                if contacto_id in prepago:
+                    continue
+                totales[contacto_id] = totales.get(contacto_id, 0) + Decimal(centavos) / 100
+            llamadas_periodo = [{'contacto_origen_id': c, 'total': t} for c, t in totales.items() if t > 0]
+            print(f"🗄️ Periodo archivado: {len(archivo)} llamadas leídas del archivo")
         
         print(f"📊 Llamadas encontradas en el periodo: {len(llamadas_periodo or [])}")
         
@@ -491,8 +542,21 @@ def generar_facturacion():
             for llamada in llamadas_periodo:
                 print(f"💰 Contacto {llamada['contacto_origen_id']}: ${llamada['total']:.2f}")
         
-        # Eliminar facturas existentes para este periodo
-        db.execute_query("DELETE FROM facturas WHERE periodo_id = ?", (periodo_id,))
+        # Las facturas pagadas se conservan: regenerarlas como pendientes permitiría volver a
+        # pagarlas y abonar dos veces el saldo de una cuenta de crédito
+        pagadas = db.execute_query(
+            "SELECT contacto_id FROM facturas WHERE periodo_id = ? AND estado = 'pagada'",
+            (periodo_id,)
+        )
+        if pagadas is None:
+            raise RuntimeError("No se pudieron leer las facturas pagadas del periodo")
+        contactos_pagados = {f['contacto_id'] for f in pagadas}
+        
+        # Eliminar facturas existentes no pagadas para este periodo
+        db.execute_query(
+            "DELETE FROM facturas WHERE periodo_id = ? AND ISNULL(estado, '') <> 'pagada'",
+            (periodo_id,)
+        )
         
         # Generar facturas
         facturas_generadas = 0
@@ -500,6 +564,9 @@ def generar_facturacion():
         
         if llamadas_periodo:
             for llamada in llamadas_periodo:
+                if llamada['contacto_origen_id'] in contactos_pagados:
+                    print(f"🔒 Contacto {llamada['contacto_origen_id']}: factura ya pagada, se conserva")
+                    continue
                 if llamada['total'] and llamada['total'] > 0:
                     print(f"✅ Generando factura para contacto {llamada['contacto_origen_id']}: ${llamada['total']:.2f}")
                     
@@ -522,6 +589,32 @@ def generar_facturacion():
     
     return redirect(url_for('gestion_facturacion'))
 
+@app.route('/facturacion/pagar/<int:factura_id>')
+@login_required(role='admin')
+def pagar_factura(factura_id):
+    try:
+        repuesto = saldo_prepago.pagar_factura(factura_id)
+        if repuesto is None:
+            flash("Factura no encontrada o ya pagada", "danger")
+        elif repuesto:
+            flash(f"✅ Factura pagada: ${repuesto:.2f} repuestos al saldo de crédito", "success")
+        else:
+            flash("✅ Factura pagada", "success")
+    except Exception as e:
+        flash(f"Error: {str(e)}", "danger")
+    
+    return redirect(url_for('gestion_facturacion'))
+
+@app.route('/facturacion/periodo/<int:periodo_id>/cerrar')
+@login_required(role='admin')
+def cerrar_periodo(periodo_id):
+    """Cierra un periodo ya terminado para que pueda archivarse"""
+    if archivo_llamadas.cerrar_periodo(periodo_id):
+        flash("✅ Periodo cerrado", "success")
+    else:
+        flash("❌ Solo se pueden cerrar periodos abiertos cuya fecha de fin ya pasó", "danger")
+    return redirect(url_for('gestion_facturacion'))
+
 # Ruta para forzar creación del periodo actual
 @app.route('/facturacion/periodo/actual')
 @login_required(role='admin')
@@ -650,6 +743,7 @@ def reportes():
         # Estadísticas por departamento
         stats_departamentos = db.execute_query("""
             SELECT 
+                d.id,
                 d.nombre,
                 COUNT(l.id) as total_llamadas,
                 ISNULL(SUM(l.costo_total), 0) as total_ingresos
@@ -658,7 +752,7 @@ def reportes():
             LEFT JOIN llamadas l ON c.id = l.contacto_origen_id
             GROUP BY d.id, d.nombre
             ORDER BY total_ingresos DESC
-        """) or []
+        """, leer_replica=True) or []
         
         print(f"🏢 Departamentos con datos: {len(stats_departamentos)}")
         
@@ -671,17 +765,43 @@ def reportes():
             FROM llamadas
             GROUP BY tipo_destino
             ORDER BY ingresos DESC
-        """) or []
+        """, leer_replica=True) or []
         
         print(f"📞 Tipos de llamada: {len(stats_tipos)}")
         
         # Estadísticas generales
-        total_llamadas = db.execute_query("SELECT COUNT(*) as total FROM llamadas")
-        total_ingresos = db.execute_query("SELECT ISNULL(SUM(costo_total), 0) as total FROM llamadas")
+        total_llamadas = db.execute_query("SELECT COUNT(*) as total FROM llamadas", leer_replica=True)
+        total_ingresos = db.execute_query("SELECT ISNULL(SUM(costo_total), 0) as total FROM llamadas", leer_replica=True)
         
         total_llamadas_count = total_llamadas[0]['total'] if total_llamadas else 0
         total_ingresos_count = total_ingresos[0]['total'] if total_ingresos else 0
         
+        # Completar con los periodos archivados y purgados de la tabla llamadas
+        historico = archivo_llamadas.resumen_historico()
+        if historico['llamadas']:
+            total_llamadas_count += historico['llamadas']
+            total_ingresos_count += Decimal(historico['centavos']) / 100
+            
+            tipos = {t['tipo_destino']: t for t in stats_tipos}
+            for tipo, (cantidad, centavos) in historico['por_tipo'].items():
+                fila = tipos.setdefault(tipo, {'tipo_destino': tipo, 'cantidad': 0, 'ingresos': 0})
+                fila['cantidad'] += cantidad
+                fila['ingresos'] += Decimal(centavos) / 100
+            stats_tipos = sorted(tipos.values(), key=lambda t: t['ingresos'], reverse=True)
+            
+            contactos_depto = db.execute_query(
+                "SELECT id, departamento_id FROM contactos WHERE departamento_id IS NOT NULL",
+                leer_replica=True
+            ) or []
+            depto_de = {c['id']: c['departamento_id'] for c in contactos_depto}
+            deptos = {d['id']: d for d in stats_departamentos}
+            for contacto_id, (cantidad, centavos) in historico['por_contacto'].items():
+                fila = deptos.get(depto_de.get(contacto_id))
+                if fila:
+                    fila['total_llamadas'] += cantidad
+                    fila['total_ingresos'] += Decimal(centavos) / 100
+            stats_departamentos = sorted(deptos.values(), key=lambda d: d['total_ingresos'], reverse=True)
+        
         print(f"📈 Totales: {total_llamadas_count} llamadas, ${total_ingresos_count:.2f} ingresos")
         
         return render_template('reportes.html',
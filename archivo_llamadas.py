@@ -0,0 +1,559 @@
+import os
+import json
+import gzip
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from config.database import db
+
+# Directorio raíz del archivo histórico de llamadas (un subdirectorio por periodo)
+ARCHIVO_DIR = os.getenv('ARCHIVO_LLAMADAS_DIR', 'archivo_llamadas')
+
+# Filas leídas por lote al exportar y filas borradas por sentencia al purgar
+LOTE_LECTURA = 50000
+LOTE_PURGA = 5000
+
+# Columnas de ancho fijo: se guardan como .npy sin comprimir para poder hacer memory-map
+COLUMNAS_FIJAS = {
+    'id': np.int64,
+    'contacto_origen_id': np.int32,
+    'duracion_segundos': np.int32,
+    'costo_centavos': np.int64,
+    'fecha_llamada': 'datetime64[s]',
+}
+
+# Columnas de texto: se guardan como códigos enteros + diccionario comprimido (-1 = NULL)
+COLUMNAS_DICCIONARIO = [
+    'numero_destino', 'tipo_destino', 'operadora_destino',
+    'departamento_destino', 'troncal_usada', 'central_usada',
+]
+
+# Predicado común para facturar, exportar, verificar y purgar exactamente las mismas filas
+# (usar siempre con los parámetros de rango_periodo)
+PREDICADO_PERIODO = "fecha_llamada >= ? AND fecha_llamada < ?"
+
+# =============================================
+# UTILIDADES
+# =============================================
+
+def ruta_periodo(periodo_id):
+    return os.path.join(ARCHIVO_DIR, f"periodo_{int(periodo_id)}")
+
+def rango_periodo(periodo):
+    """Devuelve [inicio, fin) del periodo para consultar llamadas por fecha"""
+    inicio = datetime.combine(periodo['fecha_inicio'], datetime.min.time())
+    fin = datetime.combine(periodo['fecha_fin'], datetime.min.time()) + timedelta(days=1)
+    return inicio, fin
+
+def a_centavos(valor):
+    if valor is None:
+        return 0
+    return int((Decimal(valor) * 100).to_integral_value())
+
+def _codigos_minimos(codigos, cardinalidad):
+    # Usar el entero con signo más pequeño que admita el diccionario y el -1 de NULL
+    for dtype in (np.int8, np.int16, np.int32):
+        if cardinalidad < np.iinfo(dtype).max:
+            return codigos.astype(dtype)
+    return codigos.astype(np.int64)
+
+def _sha256(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _agregar_por_contacto(contactos, centavos):
+    """{contacto_id: (cantidad_llamadas, centavos)}"""
+    if len(contactos) == 0:
+        return {}
+    ids, inversos = np.unique(contactos, return_inverse=True)
+    cantidades = np.bincount(inversos)
+    sumas = np.bincount(inversos, weights=centavos)
+    return {int(i): (int(n), int(round(c))) for i, n, c in zip(ids, cantidades, sumas)}
+
+def _agregar_por_tipo(codigos, centavos, diccionario):
+    """{tipo_destino: (cantidad_llamadas, centavos)}"""
+    codigos = np.asarray(codigos, dtype=np.int64)
+    if len(codigos) == 0:
+        return {}
+    cantidades = np.bincount(codigos, minlength=len(diccionario))
+    sumas = np.bincount(codigos, weights=centavos, minlength=len(diccionario))
+    return {diccionario[i]: (int(cantidades[i]), int(round(sumas[i])))
+            for i in range(len(diccionario)) if cantidades[i]}
+
+def _obtener_periodo(periodo_id):
+    periodo = db.execute_query("SELECT * FROM periodos_facturacion WHERE id = ?", (periodo_id,))
+    return periodo[0] if periodo else None
+
+# =============================================
+# LECTURA (MEMORY-MAP)
+# =============================================
+
+class ArchivoLlamadas:
+    """Acceso de solo lectura a un periodo archivado; las columnas se mapean en memoria al usarse"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        with open(os.path.join(ruta, 'manifiesto.json'), encoding='utf-8') as f:
+            self.manifiesto = json.load(f)
+        self._columnas = {}
+        self._diccionarios = None
+
+    @property
+    def periodo_id(self):
+        return self.manifiesto['periodo_id']
+
+    @property
+    def purgado(self):
+        return bool(self.manifiesto.get('purgado'))
+
+    def __len__(self):
+        return self.manifiesto['filas']
+
+    def columna(self, nombre):
+        if nombre not in self._columnas:
+            self._columnas[nombre] = np.load(os.path.join(self.ruta, f"{nombre}.npy"), mmap_mode='r')
+        return self._columnas[nombre]
+
+    def diccionario(self, nombre):
+        if self._diccionarios is None:
+            with gzip.open(os.path.join(self.ruta, 'diccionarios.json.gz'), 'rt', encoding='utf-8') as f:
+                self._diccionarios = json.load(f)
+        return self._diccionarios[nombre]
+
+    def valores(self, nombre, codigos):
+        dic = self.diccionario(nombre)
+        return [dic[c] if c >= 0 else None for c in codigos.tolist()]
+
+    def totales_por_contacto(self):
+        """{contacto_id: (cantidad_llamadas, centavos)}; precalculado en el manifiesto al exportar"""
+        agregados = self.manifiesto.get('por_contacto')
+        if agregados is not None:
+            return {int(k): tuple(v) for k, v in agregados.items()}
+        # Archivos exportados antes de guardar agregados: se calculan sobre las columnas mapeadas
+        return _agregar_por_contacto(self.columna('contacto_origen_id'), self.columna('costo_centavos'))
+
+    def resumen_por_tipo(self):
+        """{tipo_destino: (cantidad_llamadas, centavos)}; precalculado en el manifiesto al exportar"""
+        agregados = self.manifiesto.get('por_tipo')
+        if agregados is not None:
+            return {k: tuple(v) for k, v in agregados.items()}
+        return _agregar_por_tipo(self.columna('tipo_destino'), self.columna('costo_centavos'),
+                                 self.diccionario('tipo_destino'))
+
+    def llamadas_contacto(self, contacto_id):
+        """Genera las llamadas de un contacto como diccionarios (mismas claves que la tabla llamadas)"""
+        indices = np.flatnonzero(self.columna('contacto_origen_id') == contacto_id)
+        yield from self._filas(indices)
+
+    def llamadas_por_contacto(self):
+        """Genera (contacto_id, [llamadas]) ordenado por contacto con un único recorrido del archivo"""
+        contactos = np.asarray(self.columna('contacto_origen_id'))
+        if len(contactos) == 0:
+            return
+        orden = np.argsort(contactos, kind='stable')
+        ids, inicios = np.unique(contactos[orden], return_index=True)
+        finales = np.append(inicios[1:], len(orden))
+        for contacto_id, inicio, fin in zip(ids.tolist(), inicios.tolist(), finales.tolist()):
+            yield contacto_id, list(self._filas(orden[inicio:fin]))
+
+    def _filas(self, indices):
+        if len(indices) == 0:
+            return
+        fijas = {nombre: self.columna(nombre)[indices] for nombre in COLUMNAS_FIJAS}
+        textos = {nombre: self.valores(nombre, self.columna(nombre)[indices]) for nombre in COLUMNAS_DICCIONARIO}
+        for pos in range(len(indices)):
+            fecha = fijas['fecha_llamada'][pos]
+            yield {
+                'id': int(fijas['id'][pos]),
+                'contacto_origen_id': int(fijas['contacto_origen_id'][pos]),
+                'duracion_segundos': int(fijas['duracion_segundos'][pos]),
+                'costo_total': Decimal(int(fijas['costo_centavos'][pos])).scaleb(-2),
+                'fecha_llamada': None if np.isnat(fecha) else fecha.astype(datetime),
+                **{nombre: textos[nombre][pos] for nombre in COLUMNAS_DICCIONARIO},
+            }
+
+def abrir_periodo(periodo_id):
+    """Devuelve el ArchivoLlamadas del periodo o None si no está archivado"""
+    ruta = ruta_periodo(periodo_id)
+    if not os.path.exists(os.path.join(ruta, 'manifiesto.json')):
+        return None
+    return ArchivoLlamadas(ruta)
+
+def _rutas_periodos():
+    if not os.path.isdir(ARCHIVO_DIR):
+        return []
+    return [os.path.join(ARCHIVO_DIR, nombre) for nombre in sorted(os.listdir(ARCHIVO_DIR))
+            if nombre.startswith('periodo_')
+            and os.path.exists(os.path.join(ARCHIVO_DIR, nombre, 'manifiesto.json'))]
+
+def periodos_archivados(solo_purgados=True):
+    archivos = []
+    for ruta in _rutas_periodos():
+        archivo = ArchivoLlamadas(ruta)
+        if archivo.purgado or not solo_purgados:
+            archivos.append(archivo)
+    return archivos
+
+# Último resumen histórico y la versión de los manifiestos con que se calculó
+_cache_historico = {'version': None, 'resumen': None}
+
+def resumen_historico():
+    """Agrega los periodos ya purgados de SQL Server para completar los reportes"""
+    version = tuple((ruta, os.stat(os.path.join(ruta, 'manifiesto.json')).st_mtime_ns)
+                  for ruta in _rutas_periodos())
+    if _cache_historico['version'] == version:
+        return _cache_historico['resumen']
+
+    resumen = {'llamadas': 0, 'centavos': 0, 'por_tipo': {}, 'por_contacto': {}}
+    for archivo in periodos_archivados():
+        resumen['llamadas'] += len(archivo)
+        resumen['centavos'] += archivo.manifiesto['total_centavos']
+        for clave, destino in (('por_tipo', archivo.resumen_por_tipo()),
+                               ('por_contacto', archivo.totales_por_contacto())):
+            for k, (n, c) in destino.items():
+                previo = resumen[clave].get(k, (0, 0))
+                resumen[clave][k] = (previo[0] + n, previo[1] + c)
+
+    _cache_historico.update(version=version, resumen=resumen)
+    return resumen
+
+# =============================================
+# EXPORTACIÓN, VERIFICACIÓN Y PURGA
+# =============================================
+
+def _totales_sql(inicio, fin, id_min, id_max):
+    totales = db.execute_query(f"""
+        SELECT COUNT(*) as filas,
+               ISNULL(SUM(costo_total), 0) as costo,
+               ISNULL(SUM(CAST(duracion_segundos AS BIGINT)), 0) as duracion
+        FROM llamadas
+        WHERE {PREDICADO_PERIODO} AND id BETWEEN ? AND ?
+    """, (inicio, fin, id_min, id_max))
+    if not totales:
+        return None
+    return {
+        'filas': totales[0]['filas'],
+        'total_centavos': a_centavos(totales[0]['costo']),
+        'total_duracion': int(totales[0]['duracion']),
+    }
+
+def exportar_periodo(periodo_id):
+    """Exporta las llamadas de un periodo cerrado a archivos columnares; devuelve el ArchivoLlamadas"""
+    periodo = _obtener_periodo(periodo_id)
+    if not periodo:
+        print(f"❌ Periodo {periodo_id} no encontrado")
+        return None
+    if periodo['estado'] not in ('cerrado', 'archivado'):
+        print(f"❌ El periodo {periodo['nombre']} no está cerrado (estado: {periodo['estado']}); "
+              f"ciérrelo con 'cerrar {periodo_id}' cuando termine")
+        return None
+
+    existente = abrir_periodo(periodo_id)
+    if existente:
+        print(f"ℹ️ Periodo {periodo['nombre']} ya archivado")
+        return existente
+
+    inicio, fin = rango_periodo(periodo)
+    conn = db.get_connection()
+    if not conn:
+        return None
+
+    fijas = {nombre: [] for nombre in COLUMNAS_FIJAS}
+    codigos = {nombre: [] for nombre in COLUMNAS_DICCIONARIO}
+    diccionarios = {nombre: {} for nombre in COLUMNAS_DICCIONARIO}
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, contacto_origen_id, duracion_segundos, costo_total, fecha_llamada,
+                   {', '.join(COLUMNAS_DICCIONARIO)}
+            FROM llamadas
+            WHERE {PREDICADO_PERIODO}
+            ORDER BY id
+        """, (inicio, fin))
+
+        while True:
+            filas = cursor.fetchmany(LOTE_LECTURA)
+            if not filas:
+                break
+            fijas['id'].append(np.array([f[0] for f in filas], dtype=np.int64))
+            fijas['contacto_origen_id'].append(np.array([f[1] for f in filas], dtype=np.int32))
+            fijas['duracion_segundos'].append(np.array([f[2] for f in filas], dtype=np.int32))
+            fijas['costo_centavos'].append(np.array([a_centavos(f[3]) for f in filas], dtype=np.int64))
+            fijas['fecha_llamada'].append(np.array([f[4] for f in filas], dtype='datetime64[s]'))
+            for pos, nombre in enumerate(COLUMNAS_DICCIONARIO, start=5):
+                dic = diccionarios[nombre]
+                codigos[nombre].append(np.array(
+                    [-1 if f[pos] is None else dic.setdefault(f[pos], len(dic)) for f in filas],
+                    dtype=np.int64))
+    except Exception as e:
+        print(f"Error exportando periodo {periodo_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+    destino = ruta_periodo(periodo_id)
+    temporal = destino + '.tmp'
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+
+    archivos = {}
+    columnas = {}
+    for nombre, dtype in COLUMNAS_FIJAS.items():
+        columnas[nombre] = np.concatenate(fijas[nombre]) if fijas[nombre] else np.empty(0, dtype=dtype)
+        np.save(os.path.join(temporal, f"{nombre}.npy"), columnas[nombre])
+    for nombre in COLUMNAS_DICCIONARIO:
+        columnas[nombre] = np.concatenate(codigos[nombre]) if codigos[nombre] else np.empty(0, dtype=np.int64)
+        np.save(os.path.join(temporal, f"{nombre}.npy"),
+                _codigos_minimos(columnas[nombre], len(diccionarios[nombre])))
+    with gzip.open(os.path.join(temporal, 'diccionarios.json.gz'), 'wt', encoding='utf-8') as f:
+        json.dump({nombre: list(dic) for nombre, dic in diccionarios.items()}, f, ensure_ascii=False)
+    for nombre in os.listdir(temporal):
+        archivos[nombre] = _sha256(os.path.join(temporal, nombre))
+
+    ids = columnas['id']
+    # Agregados para reportes y refacturación, así no hay que recorrer las columnas en cada consulta
+    por_tipo = _agregar_por_tipo(columnas['tipo_destino'], columnas['costo_centavos'],
+                                 list(diccionarios['tipo_destino']))
+    por_contacto = _agregar_por_contacto(columnas['contacto_origen_id'], columnas['costo_centavos'])
+    manifiesto = {
+        'periodo_id': int(periodo_id),
+        'periodo_nombre': periodo['nombre'],
+        'fecha_inicio': str(periodo['fecha_inicio']),
+        'fecha_fin': str(periodo['fecha_fin']),
+        'filas': int(len(ids)),
+        'id_min': int(ids.min()) if len(ids) else 0,
+        'id_max': int(ids.max()) if len(ids) else 0,
+        'total_centavos': int(columnas['costo_centavos'].sum()),
+        'total_duracion': int(columnas['duracion_segundos'].sum(dtype=np.int64)),
+        'por_tipo': {tipo: list(v) for tipo, v in por_tipo.items()},
+        'por_contacto': {str(c): list(v) for c, v in por_contacto.items()},
+        'archivos': archivos,
+        'exportado': datetime.now().isoformat(timespec='seconds'),
+        'purgado': False,
+    }
+    with open(os.path.join(temporal, 'manifiesto.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2)
+
+    os.replace(temporal, destino)
+    print(f"✅ Periodo {periodo['nombre']} exportado: {manifiesto['filas']} llamadas en {destino}")
+    return ArchivoLlamadas(destino)
+
+def _guardar_manifiesto(archivo):
+    ruta_manifiesto = os.path.join(archivo.ruta, 'manifiesto.json')
+    with open(ruta_manifiesto + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(archivo.manifiesto, f, ensure_ascii=False, indent=2)
+    os.replace(ruta_manifiesto + '.tmp', ruta_manifiesto)
+
+def _restantes_en_archivo(archivo, inicio, fin):
+    """Comprueba que las filas que siguen en SQL Server son un subconjunto del archivo"""
+    m = archivo.manifiesto
+    ids = np.asarray(archivo.columna('id'))
+    costos = archivo.columna('costo_centavos')
+    duraciones = archivo.columna('duracion_segundos')
+    conn = db.get_connection()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, costo_total, duracion_segundos
+            FROM llamadas
+            WHERE {PREDICADO_PERIODO} AND id BETWEEN ? AND ?
+        """, (inicio, fin, m['id_min'], m['id_max']))
+        while True:
+            filas = cursor.fetchmany(LOTE_LECTURA)
+            if not filas:
+                return True
+            lote_ids = np.array([f[0] for f in filas], dtype=np.int64)
+            # Los ids del archivo se exportaron ordenados (ORDER BY id)
+            pos = np.minimum(np.searchsorted(ids, lote_ids), len(ids) - 1)
+            if (len(ids) == 0 or not np.array_equal(ids[pos], lote_ids)
+                    or not np.array_equal(costos[pos], [a_centavos(f[1]) for f in filas])
+                    or not np.array_equal(duraciones[pos], [f[2] for f in filas])):
+                return False
+    except Exception as e:
+        print(f"Error verificando filas restantes del periodo {m['periodo_id']}: {e}")
+        return False
+    finally:
+        conn.close()
+
+def verificar_periodo(periodo_id):
+    """Comprueba sumas de control del archivo contra sí mismo y contra SQL Server"""
+    archivo = abrir_periodo(periodo_id)
+    if not archivo:
+        print(f"❌ Periodo {periodo_id} no archivado")
+        return False
+    m = archivo.manifiesto
+
+    for nombre, digest in m['archivos'].items():
+        if _sha256(os.path.join(archivo.ruta, nombre)) != digest:
+            print(f"❌ Suma SHA-256 incorrecta en {nombre}")
+            return False
+
+    longitudes = {len(archivo.columna(n)) for n in list(COLUMNAS_FIJAS) + COLUMNAS_DICCIONARIO}
+    calculado = {
+        'filas': len(archivo.columna('id')),
+        'total_centavos': int(archivo.columna('costo_centavos').sum()),
+        'total_duracion': int(archivo.columna('duracion_segundos').sum(dtype=np.int64)),
+    }
+    if longitudes != {m['filas']} or any(calculado[k] != m[k] for k in calculado):
+        print(f"❌ El archivo del periodo {periodo_id} no coincide con su manifiesto")
+        return False
+
+    if m['purgado'] or m['filas'] == 0:
+        return True
+
+    periodo = _obtener_periodo(periodo_id)
+    if not periodo:
+        return False
+    inicio, fin = rango_periodo(periodo)
+    if m.get('purga_iniciada'):
+        # Purga interrumpida: SQL ya no tiene todas las filas, solo debe quedar un subconjunto
+        if not _restantes_en_archivo(archivo, inicio, fin):
+            print(f"❌ Quedan en SQL Server llamadas del periodo {periodo_id} que no están en el archivo")
+            return False
+        return True
+    sql = _totales_sql(inicio, fin, m['id_min'], m['id_max'])
+    if sql != calculado:
+        print(f"❌ El archivo del periodo {periodo_id} no coincide con SQL Server: {sql} != {calculado}")
+        return False
+    return True
+
+def purgar_periodo(periodo_id):
+    """Borra de llamadas las filas ya exportadas y verificadas; devuelve las filas borradas"""
+    archivo = abrir_periodo(periodo_id)
+    if not archivo:
+        print(f"❌ Periodo {periodo_id} no archivado")
+        return None
+    if archivo.purgado:
+        return 0
+    if not verificar_periodo(periodo_id):
+        print(f"❌ Verificación fallida, no se purga el periodo {periodo_id}")
+        return None
+
+    m = archivo.manifiesto
+    periodo = _obtener_periodo(periodo_id)
+    inicio, fin = rango_periodo(periodo)
+    borradas = 0
+
+    # Marcar antes del primer DELETE para poder retomar una purga que falle a mitad
+    if not m.get('purga_iniciada'):
+        m['purga_iniciada'] = datetime.now().isoformat(timespec='seconds')
+        _guardar_manifiesto(archivo)
+
+    # Borrado por lotes para no bloquear la tabla ni inflar el log de transacciones
+    while m['filas']:
+        result = db.execute_query(f"""
+            DELETE TOP ({LOTE_PURGA}) FROM llamadas
+            WHERE {PREDICADO_PERIODO} AND id BETWEEN ? AND ?
+        """, (inicio, fin, m['id_min'], m['id_max']))
+        if result is None:
+            print(f"❌ Error purgando periodo {periodo_id} tras {borradas} filas")
+            return None
+        if result == 0:
+            break
+        borradas += result
+
+    db.execute_query("UPDATE periodos_facturacion SET estado = 'archivado' WHERE id = ?", (periodo_id,))
+
+    m['purgado'] = True
+    m['fecha_purga'] = datetime.now().isoformat(timespec='seconds')
+    _guardar_manifiesto(archivo)
+
+    print(f"🗑️ Periodo {m['periodo_nombre']} purgado: {borradas} llamadas")
+    return borradas
+
+def cerrar_periodo(periodo_id=None):
+    """Pasa a 'cerrado' un periodo abierto (o, sin id, todos) cuya fecha_fin ya pasó.
+
+    Un periodo solo se cierra al terminar: las llamadas se registran con GETDATE(), así que
+    después de fecha_fin no entran más llamadas en su rango. Devuelve los periodos cerrados.
+    """
+    filtro = "estado = 'abierto' AND fecha_fin < CAST(GETDATE() AS date)"
+    params = ()
+    if periodo_id is not None:
+        periodo = _obtener_periodo(periodo_id)
+        if not periodo:
+            print(f"❌ Periodo {periodo_id} no encontrado")
+            return None
+        if periodo['estado'] != 'abierto':
+            print(f"ℹ️ El periodo {periodo['nombre']} ya está {periodo['estado']}")
+            return 0
+        filtro += " AND id = ?"
+        params = (periodo_id,)
+
+    cerrados = db.execute_query(f"UPDATE periodos_facturacion SET estado = 'cerrado' WHERE {filtro}", params)
+    if cerrados is None:
+        print("❌ No se pudo cerrar el periodo")
+        return None
+    if periodo_id is not None and not cerrados:
+        print(f"❌ El periodo {periodo['nombre']} termina el {periodo['fecha_fin']}: aún no se puede cerrar")
+        return None
+    print(f"🔒 {cerrados} periodo(s) cerrado(s)")
+    return cerrados
+
+def archivar_periodos_cerrados(purgar=True):
+    """Exporta (y opcionalmente purga) todos los periodos cerrados pendientes"""
+    periodos = db.execute_query(
+        "SELECT id FROM periodos_facturacion WHERE estado = 'cerrado' ORDER BY fecha_inicio"
+    ) or []
+    resultados = []
+    for periodo in periodos:
+        archivo = exportar_periodo(periodo['id'])
+        if archivo and purgar:
+            resultados.append((periodo['id'], purgar_periodo(periodo['id'])))
+        else:
+            resultados.append((periodo['id'], None if not archivo else 0))
+    return resultados
+
+# =============================================
+# LÍNEA DE COMANDOS
+# =============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Archivo columnar de llamadas de periodos cerrados')
+    sub = parser.add_subparsers(dest='accion', required=True)
+    for accion in ('exportar', 'verificar', 'purgar'):
+        sub.add_parser(accion).add_argument('periodo_id', type=int)
+    cerrar = sub.add_parser('cerrar', help='Cerrar periodos abiertos cuya fecha_fin ya pasó')
+    cerrar.add_argument('periodo_id', type=int, nargs='?', help='Solo este periodo (por defecto todos los vencidos)')
+    cerrados = sub.add_parser('cerrados', help='Exportar todos los periodos cerrados pendientes')
+    cerrados.add_argument('--sin-purga', action='store_true')
+    cerrados.add_argument('--cerrar-vencidos', action='store_true',
+                          help='Cerrar antes los periodos abiertos cuya fecha_fin ya pasó')
+    sub.add_parser('listar')
+    args = parser.parse_args()
+
+    if args.accion == 'exportar':
+        ok = exportar_periodo(args.periodo_id) is not None
+    elif args.accion == 'verificar':
+        ok = verificar_periodo(args.periodo_id)
+        print("✅ Archivo verificado" if ok else "❌ Archivo inválido")
+    elif args.accion == 'purgar':
+        ok = purgar_periodo(args.periodo_id) is not None
+    elif args.accion == 'cerrar':
+        ok = cerrar_periodo(args.periodo_id) is not None
+    elif args.accion == 'cerrados':
+        if args.cerrar_vencidos and cerrar_periodo() is None:
+            raise SystemExit(1)
+        ok = all(r is not None for _, r in archivar_periodos_cerrados(purgar=not args.sin_purga))
+    else:
+        for archivo in periodos_archivados(solo_purgados=False):
+            m = archivo.manifiesto
+            estado = 'purgado' if archivo.purgado else ('purga incompleta' if m.get('purga_iniciada') else 'exportado')
+            print(f"{m['periodo_id']:>5}  {m['periodo_nombre']:<20} {m['filas']:>10} llamadas  "
+                  f"${m['total_centavos'] / 100:,.2f}  {estado}")
+        ok = True
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
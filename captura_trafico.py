@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import hmac
+import hashlib
+import secrets
+import threading
+
+from flask import request, session, g
+
+# Archivo JSONL donde se graban las trazas; si no se define, la captura queda desactivada
+CAPTURA_ARCHIVO = os.getenv('CAPTURA_TRAFICO')
+
+# Clave HMAC para seudonimizar usuarios y números. Sin CAPTURA_TRAFICO_SAL se genera una aleatoria
+# por ejecución: los seudónimos son consistentes dentro de la captura pero no se pueden revertir
+# probando números conocidos ni correlacionar entre capturas
+CAPTURA_SAL = os.getenv('CAPTURA_TRAFICO_SAL') or secrets.token_hex(32)
+
+# Rutas que se graban (reglas de Flask, no paths concretos)
+RUTAS_CAPTURADAS = {
+    '/login',
+    '/dashboard',
+    '/llamadas/simular',
+    '/facturacion/generar',
+    '/reportes',
+}
+
+# Parámetros que nunca se guardan
+PARAMETROS_OCULTOS = {'password', 'nombre'}
+
+# Parámetros con números de teléfono: se reemplazan conservando el tipo de número
+PARAMETROS_NUMERO = {'numero', 'numero_destino'}
+
+def _seudonimo(valor):
+    return hmac.new(CAPTURA_SAL.encode(), str(valor).encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+
+def sanitizar_numero(numero):
+    """Reemplaza los dígitos conservando prefijo '+', primer dígito y largo (mismo tipo de destino)"""
+    numero = (numero or '').strip()
+    if not numero:
+        return numero
+    prefijo = '+' if numero.startswith('+') else ''
+    cuerpo = numero[len(prefijo):]
+    if not cuerpo:
+        return numero
+    digitos = ''.join(c for c in _seudonimo(numero) * 2 if c.isdigit())
+    relleno = (digitos + '0' * len(cuerpo))[:len(cuerpo) - 1]
+    return prefijo + cuerpo[0] + relleno
+
+def sanitizar_parametros(form):
+    parametros = {}
+    for clave, valor in form.items():
+        if clave in PARAMETROS_OCULTOS:
+            continue
+        if clave in PARAMETROS_NUMERO:
+            valor = sanitizar_numero(valor)
+        elif clave == 'username':
+            valor = f"usuario_{_seudonimo(valor)}"
+        parametros[clave] = valor
+    return parametros
+
+class CapturaTrafico:
+    """Graba trazas sanitizadas de las peticiones en un archivo JSONL (una línea por petición)"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._archivo = open(ruta, 'a', encoding='utf-8', buffering=1)
+
+    def antes(self):
+        # La traza se fecha con la llegada de la petición: la repetición la programa a esa hora
+        g._captura_ts = time.time()
+        g._captura_inicio = time.perf_counter()
+
+    def despues(self, response):
+        inicio = getattr(g, '_captura_inicio', None)
+        regla = request.url_rule.rule if request.url_rule else None
+        if inicio is None or regla not in RUTAS_CAPTURADAS:
+            return response
+
+        # Tras el login la sesión ya tiene user_id, así el POST /login queda en la sesión del usuario
+        user_id = session.get('user_id')
+        traza = {
+            'ts': round(g._captura_ts, 6),
+            'ruta': regla,
+            'metodo': request.method,
+            'path': request.path,
+            'parametros': sanitizar_parametros(request.form),
+            'sesion': _seudonimo(user_id) if user_id is not None else 'anonimo',
+            'status': response.status_code,
+            'duracion_ms': round((time.perf_counter() - inicio) * 1000, 3),
+        }
+        linea = json.dumps(traza, ensure_ascii=False)
+        with self._lock:
+            self._archivo.write(linea + '\n')
+        return response
+
+def instalar(app, ruta=None):
+    """Activa la captura en la app si CAPTURA_TRAFICO (o `ruta`) está definido"""
+    ruta = ruta or CAPTURA_ARCHIVO
+    if not ruta:
+        return None
+    captura = CapturaTrafico(ruta)
+    app.before_request(captura.antes)
+    app.after_request(captura.despues)
+    print(f"🎥 Captura de tráfico activa en {ruta}")
+    return captura
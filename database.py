@@ -1,5 +1,8 @@
 import pyodbc
 import os
+import time
+import threading
+import itertools
 
 class DatabaseConfig:
     def __init__(self):
@@ -10,37 +13,147 @@ class DatabaseConfig:
         self.password = os.getenv('DB_PASSWORD', 'YourStrong!Pass123')
         self.connection_string = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={self.server};DATABASE={self.database};UID={self.username};PWD={self.password}'
 
+        # Réplicas de solo lectura (servidores separados por coma, mismas credenciales)
+        self.replica_servers = [s.strip() for s in os.getenv('DB_REPLICA_SERVERS', '').split(',') if s.strip()]
+        self.replica_connection_strings = [
+            f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={self.database};UID={self.username};PWD={self.password}'
+            for server in self.replica_servers
+        ]
+        # Segundos que una sesión lee del primario después de escribir (retraso de replicación)
+        self.replica_sticky_seconds = float(os.getenv('DB_REPLICA_STICKY_SECONDS', '5'))
+        # Segundos antes de volver a probar una réplica expulsada
+        self.replica_retry_seconds = float(os.getenv('DB_REPLICA_RETRY_SECONDS', '30'))
+
 class Database:
-    def __init__(self):
-        self.config = DatabaseConfig()
-    
-    def get_connection(self):
+    def __init__(self, config=None, conectar=None):
+        self.config = config or DatabaseConfig()
+        # Función de conexión inyectable para probar el enrutamiento con bases locales
+        self.conectar = conectar or pyodbc.connect
+        # Devuelve el diccionario de la sesión actual (p. ej. flask.session) para read-your-writes
+        self.sesion = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._expulsadas = {}
+        self._turno = itertools.count()
+
+    def get_connection(self, leer_replica=False):
+        if leer_replica:
+            conn, _ = self._conexion_replica()
+            if conn:
+                return conn
         try:
-            conn = pyodbc.connect(self.config.connection_string)
+            conn = self.conectar(self.config.connection_string)
             return conn
         except Exception as e:
             print(f"Error de conexión: {e}")
             return None
-    
-    def execute_query(self, query, params=None):
+
+    # =============================================
+    # ENRUTAMIENTO A RÉPLICAS
+    # =============================================
+
+    def _estado_sesion(self):
+        sesion = self.sesion() if self.sesion else None
+        if sesion is not None:
+            return sesion
+        # Fuera de una petición (CLI, hilos) la "sesión" es el hilo actual
+        if not hasattr(self._local, 'estado'):
+            self._local.estado = {}
+        return self._local.estado
+
+    def _registrar_escritura(self):
+        self._estado_sesion()['_db_ultima_escritura'] = time.time()
+
+    def _lectura_pegada(self):
+        ultima = self._estado_sesion().get('_db_ultima_escritura')
+        return ultima is not None and time.time() - ultima < self.config.replica_sticky_seconds
+
+    def replicas_disponibles(self):
+        ahora = time.monotonic()
+        with self._lock:
+            return [dsn for dsn in self.config.replica_connection_strings
+                    if ahora - self._expulsadas.get(dsn, float('-inf')) >= self.config.replica_retry_seconds]
+
+    def expulsar_replica(self, dsn, motivo):
+        with self._lock:
+            self._expulsadas[dsn] = time.monotonic()
+        print(f"⚠️ Réplica expulsada por {self.config.replica_retry_seconds:.0f}s: {motivo}")
+
+    def verificar_replica(self, dsn):
+        """Health check: abre una conexión y ejecuta SELECT 1; expulsa la réplica si falla"""
+        try:
+            conn = self.conectar(dsn)
+            try:
+                conn.cursor().execute("SELECT 1").fetchall()
+            finally:
+                conn.close()
+        except Exception as e:
+            self.expulsar_replica(dsn, e)
+            return False
+        with self._lock:
+            self._expulsadas.pop(dsn, None)
+        return True
+
+    def _conexion_replica(self):
+        """Devuelve (conexión, dsn) de una réplica sana en turno rotativo o (None, None)"""
+        if self._lectura_pegada():
+            return None, None
+        candidatas = self.replicas_disponibles()
+        if not candidatas:
+            return None, None
+        inicio = next(self._turno)
+        for i in range(len(candidatas)):
+            dsn = candidatas[(inicio + i) % len(candidatas)]
+            # Una réplica que vuelve de estar expulsada se revisa antes de recibir lecturas
+            with self._lock:
+                reintento = dsn in self._expulsadas
+            if reintento and not self.verificar_replica(dsn):
+                continue
+            try:
+                return self.conectar(dsn), dsn
+            except Exception as e:
+                self.expulsar_replica(dsn, e)
+        return None, None
+
+    def _ejecutar(self, conn, query, params):
+        cursor = conn.cursor()
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+
+        if query.strip().upper().startswith('SELECT'):
+            result = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in result]
+        else:
+            conn.commit()
+            return cursor.rowcount
+
+    def execute_query(self, query, params=None, leer_replica=False):
+        es_lectura = query.strip().upper().startswith('SELECT')
+
+        # Solo las lecturas marcadas explícitamente pueden ir a una réplica
+        if leer_replica and es_lectura and self.config.replica_connection_strings:
+            conn, dsn = self._conexion_replica()
+            if conn:
+                try:
+                    return self._ejecutar(conn, query, params)
+                except Exception as e:
+                    print(f"Error en réplica, reintentando en primario: {e}")
+                    self.verificar_replica(dsn)
+                finally:
+                    conn.close()
+
         conn = self.get_connection()
         if not conn:
             return None
-        
+
         try:
-            cursor = conn.cursor()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            if query.strip().upper().startswith('SELECT'):
-                result = cursor.fetchall()
-                columns = [column[0] for column in cursor.description]
-                return [dict(zip(columns, row)) for row in result]
-            else:
-                conn.commit()
-                return cursor.rowcount
+            result = self._ejecutar(conn, query, params)
+            if not es_lectura:
+                self._registrar_escritura()
+            return result
         except Exception as e:
             print(f"Error en consulta: {e}")
             return None
@@ -48,4 +161,4 @@ class Database:
             conn.close()
 
 # Instancia global de la base de datos
-db = Database()
\ No newline at end of file
+db = Database()
@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import heapq
+import hashlib
+import zipfile
+import argparse
+import resource
+from itertools import groupby
+from decimal import Decimal
+from datetime import datetime
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib import colors
+
+from config.database import db
+import archivo_llamadas
+
+# Directorio raíz de los PDF generados (un subdirectorio por periodo)
+PDF_DIR = os.getenv('FACTURAS_PDF_DIR', 'facturas_pdf')
+
+# Cambiar al modificar el diseño del PDF para forzar el re-renderizado de todo
+VERSION_PLANTILLA = 2
+
+LOTE_LECTURA = 20000
+
+# =============================================
+# RENDERIZADO (SE EJECUTA EN LOS PROCESOS DEL POOL)
+# =============================================
+
+# Estilos compartidos por todos los documentos de un proceso
+_estilos = None
+
+def _iniciar_worker():
+    """Construye una sola vez por proceso las hojas de estilo y estilos de tabla"""
+    global _estilos
+    hoja = getSampleStyleSheet()
+    _estilos = {
+        'titulo': hoja['Title'],
+        'subtitulo': hoja['Heading2'],
+        'normal': hoja['Normal'],
+        'tabla': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f4e79')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('ALIGN', (3, 0), (-1, -1), 'RIGHT'),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f2f2f2')]),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ]),
+        'totales': TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ]),
+    }
+
+def _duracion(segundos):
+    return f"{segundos // 60}m {segundos % 60}s"
+
+def _renderizar_factura(datos, ruta):
+    """Genera el PDF de una factura y devuelve métricas del proceso que lo hizo"""
+    if _estilos is None:
+        _iniciar_worker()
+    inicio = time.perf_counter()
+
+    temporal = ruta + '.tmp'
+    doc = SimpleDocTemplate(temporal, pagesize=letter, title=f"Factura {datos['numero_factura']}")
+    elementos = [
+        Paragraph("Tarificador Nicaragua", _estilos['titulo']),
+        Paragraph(f"Factura {datos['numero_factura']} - {escape(datos['periodo_nombre'])}", _estilos['subtitulo']),
+        Paragraph(f"Cliente: {escape(datos['contacto_nombre'])} ({escape(datos['contacto_numero'])})", _estilos['normal']),
+        Paragraph(f"Periodo: {datos['fecha_inicio']} a {datos['fecha_fin']}", _estilos['normal']),
+        Spacer(1, 12),
+    ]
+
+    filas = [['Fecha', 'Destino', 'Tipo', 'Duración', 'Costo']]
+    for llamada in datos['llamadas']:
+        fecha = llamada['fecha_llamada']
+        filas.append([
+            fecha.strftime('%Y-%m-%d %H:%M') if fecha else '',
+            llamada['numero_destino'],
+            llamada['tipo_destino'],
+            _duracion(llamada['duracion_segundos']),
+            f"${llamada['costo_total']:.2f}",
+        ])
+    tabla = Table(filas, repeatRows=1, colWidths=[120, 110, 90, 80, 80])
+    tabla.setStyle(_estilos['tabla'])
+    elementos.append(tabla)
+    elementos.append(Spacer(1, 12))
+
+    totales = Table([
+        ['Llamadas', str(len(datos['llamadas']))],
+        ['Total a pagar', f"${datos['total']:.2f}"],
+    ], colWidths=[400, 80])
+    totales.setStyle(_estilos['totales'])
+    elementos.append(totales)
+
+    doc.build(elementos)
+    os.replace(temporal, ruta)
+
+    return {
+        'contacto_id': datos['contacto_id'],
+        'paginas': doc.page,
+        'segundos': time.perf_counter() - inicio,
+        'pid': os.getpid(),
+        # ru_maxrss está en KB en Linux
+        'memoria_pico_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+# =============================================
+# LECTURA DE LLAMADAS POR CONTACTO
+# =============================================
+
+CENTAVO = Decimal('0.01')
+
+def _llamada_factura(fecha, numero_destino, tipo_destino, duracion_segundos, costo_total):
+    """Solo los campos impresos, normalizados igual venga la llamada de SQL Server o del archivo.
+
+    Así la huella de una factura no cambia cuando su periodo se purga y se lee del archivo
+    (que guarda la fecha al segundo y el costo en centavos).
+    """
+    return {
+        'fecha_llamada': fecha.replace(microsecond=0) if fecha else None,
+        'numero_destino': numero_destino,
+        'tipo_destino': tipo_destino,
+        'duracion_segundos': int(duracion_segundos),
+        'costo_total': Decimal(costo_total).quantize(CENTAVO),
+    }
+
+def _llamadas_sql(periodo):
+    """Abre la consulta de llamadas del periodo y devuelve un generador de (contacto_id, [llamadas]).
+
+    La conexión y la consulta se abren al llamar, no al iterar: si fallan se lanza la excepción
+    antes de renderizar nada, en lugar de emitir facturas sin detalle.
+    """
+    # Lectura pesada de reporte: va a una réplica si hay alguna configurada
+    conn = db.get_connection(leer_replica=True)
+    if not conn:
+        raise RuntimeError("No se pudo conectar a la base de datos para leer las llamadas")
+    try:
+        cursor = conn.cursor()
+        # Mismo rango de fechas que generar_facturacion para que el detalle cuadre con el total
+        cursor.execute(f"""
+            SELECT contacto_origen_id, fecha_llamada, numero_destino, tipo_destino,
+                   duracion_segundos, costo_total
+            FROM llamadas
+            WHERE {archivo_llamadas.PREDICADO_PERIODO}
+            ORDER BY contacto_origen_id, fecha_llamada, id
+        """, archivo_llamadas.rango_periodo(periodo))
+    except Exception:
+        conn.close()
+        raise
+
+    def filas():
+        while True:
+            lote = cursor.fetchmany(LOTE_LECTURA)
+            if not lote:
+                return
+            yield from lote
+
+    def grupos():
+        try:
+            for contacto_id, grupo in groupby(filas(), key=lambda f: f[0]):
+                yield contacto_id, [_llamada_factura(*f[1:]) for f in grupo]
+        finally:
+            conn.close()
+
+    return grupos()
+
+def llamadas_por_contacto(periodo):
+    """Une las llamadas vivas en SQL Server con las del archivo columnar si el periodo fue purgado.
+
+    Lanza la excepción de inmediato si no se puede abrir la lectura en SQL Server.
+    """
+    fuentes = [_llamadas_sql(periodo)]
+    archivo = archivo_llamadas.abrir_periodo(periodo['id'])
+    if archivo and archivo.purgado:
+        fuentes.insert(0, (
+            (contacto_id, [_llamada_factura(l['fecha_llamada'], l['numero_destino'], l['tipo_destino'],
+                                            l['duracion_segundos'], l['costo_total']) for l in llamadas])
+            for contacto_id, llamadas in archivo.llamadas_por_contacto()
+        ))
+
+    def unir():
+        unidas = heapq.merge(*fuentes, key=lambda par: par[0])
+        for contacto_id, grupo in groupby(unidas, key=lambda par: par[0]):
+            llamadas = []
+            for _, parte in grupo:
+                llamadas.extend(parte)
+            yield contacto_id, llamadas
+
+    return unir()
+
+# =============================================
+# LOTE POR PERIODO
+# =============================================
+
+def _huella(datos):
+    contenido = json.dumps({'version': VERSION_PLANTILLA, **datos}, sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+def _cargar_manifiesto(directorio):
+    try:
+        with open(os.path.join(directorio, 'manifiesto.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def empaquetar_zip(directorio, ruta_zip):
+    """Escribe los PDF y el manifiesto en un ZIP, archivo por archivo sin cargarlos en memoria"""
+    # Los PDF ya vienen comprimidos, así que se guardan sin volver a comprimir
+    with zipfile.ZipFile(ruta_zip, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for nombre in sorted(os.listdir(directorio)):
+            if nombre.endswith('.pdf') or nombre == 'manifiesto.json':
+                zf.write(os.path.join(directorio, nombre), arcname=nombre)
+    return ruta_zip
+
+def renderizar_periodo(periodo_id, procesos=None, forzar=False, ruta_zip=None, max_en_vuelo=None):
+    """Genera los PDF de todas las facturas de un periodo; devuelve las estadísticas del lote"""
+    periodo = db.execute_query("SELECT * FROM periodos_facturacion WHERE id = ?", (periodo_id,))
+    if not periodo:
+        print(f"❌ Periodo {periodo_id} no encontrado")
+        return None
+    periodo = periodo[0]
+
+    facturas = db.execute_query("""
+        SELECT f.id, f.contacto_id, f.total, f.estado, c.nombre, c.numero
+        FROM facturas f
+        JOIN contactos c ON f.contacto_id = c.id
+        WHERE f.periodo_id = ?
+    """, (periodo_id,)) or []
+    por_contacto = {f['contacto_id']: f for f in facturas}
+
+    # Si no se puede leer el detalle se aborta: seguir emitiría facturas vacías sobre PDF correctos
+    try:
+        fuente_llamadas = llamadas_por_contacto(periodo)
+    except Exception as e:
+        print(f"❌ No se pudieron leer las llamadas del periodo {periodo['nombre']}: {e}")
+        return None
+
+    directorio = os.path.join(PDF_DIR, f"periodo_{int(periodo_id)}")
+    os.makedirs(directorio, exist_ok=True)
+    previo = _cargar_manifiesto(directorio).get('facturas', {})
+    manifiesto = {}
+
+    procesos = procesos or os.cpu_count() or 1
+    max_en_vuelo = max_en_vuelo or procesos * 4
+    stats = {'renderizadas': 0, 'omitidas': 0, 'errores': 0, 'paginas': 0, 'workers': {}}
+    inicio = time.perf_counter()
+
+    def registrar(futuros):
+        for futuro in futuros:
+            clave = pendientes_clave.pop(futuro)
+            try:
+                r = futuro.result()
+            except Exception as e:
+                # Sin entrada en el manifiesto, la siguiente ejecución lo vuelve a intentar
+                print(f"❌ Error generando factura del contacto {clave}: {e}")
+                manifiesto.pop(clave, None)
+                stats['errores'] += 1
+                continue
+            stats['renderizadas'] += 1
+            stats['paginas'] += r['paginas']
+            manifiesto[str(r['contacto_id'])]['paginas'] = r['paginas']
+            worker = stats['workers'].setdefault(r['pid'], {'documentos': 0, 'memoria_pico_kb': 0})
+            worker['documentos'] += 1
+            worker['memoria_pico_kb'] = max(worker['memoria_pico_kb'], r['memoria_pico_kb'])
+
+    def trabajos():
+        vistos = set()
+        for contacto_id, llamadas in fuente_llamadas:
+            if contacto_id in por_contacto:
+                vistos.add(contacto_id)
+                yield por_contacto[contacto_id], llamadas
+        # Facturas sin llamadas disponibles (p. ej. periodo purgado sin archivo) se emiten vacías
+        for contacto_id, factura in por_contacto.items():
+            if contacto_id not in vistos:
+                yield factura, []
+
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_worker) as pool:
+        pendientes = set()
+        pendientes_clave = {}
+        for factura, llamadas in trabajos():
+            datos = {
+                'contacto_id': factura['contacto_id'],
+                # Número estable entre regeneraciones de facturas (el id de factura cambia)
+                'numero_factura': f"{int(periodo_id)}-{factura['contacto_id']}",
+                'periodo_nombre': periodo['nombre'],
+                'fecha_inicio': str(periodo['fecha_inicio']),
+                'fecha_fin': str(periodo['fecha_fin']),
+                'contacto_nombre': factura['nombre'],
+                'contacto_numero': factura['numero'],
+                'total': factura['total'],
+                'llamadas': llamadas,
+            }
+            huella = _huella(datos)
+            clave = str(factura['contacto_id'])
+            archivo = f"contacto_{factura['contacto_id']}.pdf"
+            ruta = os.path.join(directorio, archivo)
+
+            anterior = previo.get(clave)
+            if not forzar and anterior and anterior['huella'] == huella and os.path.exists(ruta):
+                manifiesto[clave] = anterior
+                stats['omitidas'] += 1
+                continue
+
+            manifiesto[clave] = {
+                'archivo': archivo,
+                'factura_id': factura['id'],
+                'total': str(factura['total']),
+                'llamadas': len(llamadas),
+                'huella': huella,
+            }
+            futuro = pool.submit(_renderizar_factura, datos, ruta)
+            pendientes.add(futuro)
+            pendientes_clave[futuro] = clave
+            # Limitar las facturas en vuelo para no acumular en memoria todo el periodo
+            if len(pendientes) >= max_en_vuelo:
+                listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                registrar(listos)
+        registrar(wait(pendientes).done)
+
+    # Quitar PDF de contactos que ya no tienen factura en el periodo
+    for clave, anterior in previo.items():
+        if clave not in manifiesto:
+            ruta = os.path.join(directorio, anterior['archivo'])
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+    segundos = time.perf_counter() - inicio
+    stats['segundos'] = round(segundos, 3)
+    stats['paginas_por_segundo'] = round(stats['paginas'] / segundos, 1) if segundos else 0
+
+    temporal = os.path.join(directorio, 'manifiesto.json.tmp')
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump({
+            'periodo_id': int(periodo_id),
+            'periodo_nombre': periodo['nombre'],
+            'version_plantilla': VERSION_PLANTILLA,
+            'generado': datetime.now().isoformat(timespec='seconds'),
+            'facturas': manifiesto,
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, os.path.join(directorio, 'manifiesto.json'))
+
+    if ruta_zip:
+        empaquetar_zip(directorio, ruta_zip)
+
+    print(f"🧾 Periodo {periodo['nombre']}: {stats['renderizadas']} PDF generados, "
+          f"{stats['omitidas']} sin cambios, {stats['errores']} con error, {stats['paginas']} páginas en {segundos:.1f}s "
+          f"({stats['paginas_por_segundo']} páginas/s)")
+    for pid, worker in sorted(stats['workers'].items()):
+        print(f"   Worker {pid}: {worker['documentos']} documentos, "
+              f"memoria pico {worker['memoria_pico_kb'] / 1024:.1f} MB")
+    return stats
+
+# =============================================
+# LÍNEA DE COMANDOS
+# =============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Generación masiva de facturas PDF por periodo')
+    parser.add_argument('periodo_id', type=int)
+    parser.add_argument('--procesos', type=int, default=None, help='Procesos del pool (por defecto, núcleos disponibles)')
+    parser.add_argument('--forzar', action='store_true', help='Volver a generar también las facturas sin cambios')
+    parser.add_argument('--zip', dest='ruta_zip', help='Empaquetar además los PDF y el manifiesto en este ZIP')
+    args = parser.parse_args()
+
+    stats = renderizar_periodo(args.periodo_id, args.procesos, args.forzar, args.ruta_zip)
+    raise SystemExit(0 if stats is not None else 1)
+
+if __name__ == '__main__':
+    main()
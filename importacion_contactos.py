@@ -0,0 +1,242 @@
+import io
+import csv
+import argparse
+
+import numpy as np
+
+from config.database import db
+
+# Filas insertadas por transacción
+LOTE_INSERCION = 1000
+
+COLUMNAS_REPORTE = ['fila', 'nombre', 'numero', 'tipo', 'estado', 'motivo']
+
+# =============================================
+# NORMALIZACIÓN Y CLASIFICACIÓN VECTORIZADA
+# =============================================
+
+def normalizar_numeros(numeros):
+    """Quita espacios y separadores habituales de un arreglo de números"""
+    arr = np.char.strip(np.asarray(numeros, dtype=str))
+    for separador in (' ', '-', '(', ')', '.'):
+        arr = np.char.replace(arr, separador, '')
+    return arr
+
+def clasificar_numeros(numeros):
+    """Valida y clasifica números con las mismas reglas que determinar_tipo_destino.
+
+    Devuelve (normalizados, validos, tipos) como arreglos alineados con la entrada.
+    """
+    normalizados = normalizar_numeros(numeros)
+    if len(normalizados) == 0:
+        return normalizados, np.zeros(0, dtype=bool), np.empty(0, dtype='U13')
+
+    internacional = np.char.startswith(normalizados, '+')
+    # Se quita exactamente un '+': '++505...' deja un '+' en el cuerpo y resulta inválido
+    cuerpo = np.where(internacional, np.char.partition(normalizados, '+')[:, 2], normalizados)
+    largo = np.char.str_len(cuerpo)
+    # isdigit acepta dígitos Unicode ('٣', '²'); el largo en UTF-8 igual al de caracteres exige ASCII
+    solo_ascii = np.char.str_len(np.char.encode(cuerpo, 'utf-8')) == largo
+    digitos = np.char.isdigit(cuerpo) & solo_ascii
+
+    nacional_valido = ~internacional & digitos & (largo == 8)
+    internacional_valido = internacional & digitos & (largo >= 8) & (largo <= 15)
+    celular = nacional_valido & np.isin(cuerpo.astype('U1'), ['5', '7', '8'])
+
+    tipos = np.where(internacional, 'internacional', np.where(celular, 'celular', 'convencional'))
+    return normalizados, nacional_valido | internacional_valido, tipos
+
+# =============================================
+# CATÁLOGOS EN MEMORIA
+# =============================================
+
+def cargar_numeros_existentes():
+    """Conjunto hash con los números ya registrados (normalizados)"""
+    existentes = db.execute_query("SELECT numero FROM contactos")
+    if existentes is None:
+        return None
+    return set(normalizar_numeros([c['numero'] for c in existentes]).tolist()) if existentes else set()
+
+def cargar_catalogos():
+    tipos = db.execute_query("SELECT id, tipo FROM tipos_numero") or []
+    operadoras = db.execute_query("SELECT id, nombre, prefijo FROM operadoras") or []
+    departamentos = db.execute_query("SELECT id, nombre, prefijo FROM departamentos") or []
+    return {
+        'tipos': {t['tipo'].lower(): t['id'] for t in tipos},
+        'operadoras': {o['nombre'].lower(): o['id'] for o in operadoras},
+        'operadoras_prefijo': {o['prefijo']: o['id'] for o in operadoras},
+        'departamentos': {
+            **{d['prefijo']: d['id'] for d in departamentos},
+            **{d['nombre'].lower(): d['id'] for d in departamentos},
+        },
+    }
+
+# =============================================
+# IMPORTACIÓN
+# =============================================
+
+def _insertar_lotes(filas, reporte, lote):
+    """Inserta en transacciones de `lote` filas; si un lote falla se reintenta fila a fila"""
+    conn = db.get_connection()
+    if not conn:
+        for fila in filas:
+            reporte[fila['indice']].update(estado='rechazado', motivo='Sin conexión a la base de datos')
+        return 0
+
+    insert_query = """
+        INSERT INTO contactos (nombre, numero, tipo_numero_id, operadora_id, departamento_id)
+        VALUES (?, ?, ?, ?, ?)
+    """
+    insertados = 0
+    try:
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        for inicio in range(0, len(filas), lote):
+            bloque = filas[inicio:inicio + lote]
+            try:
+                cursor.executemany(insert_query, [f['params'] for f in bloque])
+                conn.commit()
+                resultado = [(f, None) for f in bloque]
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ Lote {inicio // lote + 1} falló ({e}), reintentando fila a fila")
+                resultado = []
+                for f in bloque:
+                    try:
+                        cursor.execute(insert_query, f['params'])
+                        conn.commit()
+                        resultado.append((f, None))
+                    except Exception as e_fila:
+                        conn.rollback()
+                        resultado.append((f, str(e_fila)))
+            for f, error in resultado:
+                if error:
+                    reporte[f['indice']].update(estado='rechazado', motivo=f"Error al insertar: {error}")
+                else:
+                    reporte[f['indice']]['estado'] = 'insertado'
+                    insertados += 1
+    finally:
+        conn.close()
+    return insertados
+
+def importar_contactos(filas, lote=LOTE_INSERCION):
+    """Importa una lista de diccionarios (nombre, numero y opcionalmente tipo, operadora, departamento).
+
+    Devuelve (insertados, reporte) donde el reporte tiene una entrada por fila de entrada.
+    """
+    # csv.DictReader deja bajo la clave None los campos que sobran respecto a la cabecera
+    sobrantes = [None in f for f in filas]
+    filas = [{k.strip().lower(): (v or '').strip() for k, v in f.items() if k is not None} for f in filas]
+    nombres = np.array([f.get('nombre', '') for f in filas], dtype=str)
+    normalizados, validos, tipos = clasificar_numeros([f.get('numero', '') for f in filas])
+    numeros, tipos_lista = normalizados.tolist(), tipos.tolist()
+
+    reporte = [{
+        'fila': i + 2,  # +1 por la cabecera del CSV y +1 por numerar desde 1
+        'nombre': filas[i].get('nombre', ''),
+        'numero': numeros[i],
+        'tipo': tipos_lista[i] if validos[i] else '',
+        'estado': 'rechazado',
+        'motivo': '',
+    } for i in range(len(filas))]
+
+    existentes = cargar_numeros_existentes()
+    if existentes is None:
+        for r in reporte:
+            r['motivo'] = 'No se pudieron leer los contactos existentes'
+        return 0, reporte
+    catalogos = cargar_catalogos()
+
+    largo_nombre = np.char.str_len(nombres)
+    sin_nombre = largo_nombre == 0
+    nombre_largo = largo_nombre > 100
+
+    # Números de filas ya aceptadas -> fila del CSV; las rechazadas no cuentan como primera aparición
+    aceptados = {}
+    pendientes = []
+    for i, fila in enumerate(filas):
+        numero = numeros[i]
+        if sobrantes[i]:
+            motivo = 'La fila tiene más columnas que la cabecera'
+        elif sin_nombre[i]:
+            motivo = 'Nombre vacío'
+        elif nombre_largo[i]:
+            motivo = 'Nombre mayor a 100 caracteres'
+        elif not validos[i]:
+            motivo = 'Número inválido'
+        elif numero in existentes:
+            motivo = 'El número ya existe'
+        elif numero in aceptados:
+            motivo = f"Número duplicado en el archivo (fila {aceptados[numero]})"
+        else:
+            motivo = None
+
+        tipo = (fila.get('tipo') or tipos_lista[i]).lower()
+        tipo_id = catalogos['tipos'].get(tipo)
+        operadora_id = departamento_id = None
+        if motivo is None and tipo_id is None:
+            motivo = f"Tipo de número no configurado: {tipo}"
+        if motivo is None:
+            if fila.get('operadora'):
+                operadora_id = catalogos['operadoras'].get(fila['operadora'].lower())
+                if operadora_id is None:
+                    motivo = f"Operadora desconocida: {fila['operadora']}"
+            elif tipos_lista[i] == 'celular':
+                operadora_id = catalogos['operadoras_prefijo'].get(numero[0])
+        if motivo is None and fila.get('departamento'):
+            departamento_id = catalogos['departamentos'].get(fila['departamento'].lower())
+            if departamento_id is None:
+                motivo = f"Departamento desconocido: {fila['departamento']}"
+
+        if motivo:
+            reporte[i]['motivo'] = motivo
+            continue
+        aceptados[numero] = i + 2
+        pendientes.append({
+            'indice': i,
+            'params': (fila['nombre'], numero, tipo_id, operadora_id, departamento_id),
+        })
+
+    insertados = _insertar_lotes(pendientes, reporte, lote) if pendientes else 0
+    print(f"📥 Importación de contactos: {insertados} insertados, {len(filas) - insertados} rechazados")
+    return insertados, reporte
+
+def importar_csv(archivo, lote=LOTE_INSERCION):
+    """Importa contactos desde un archivo CSV (ruta, bytes o flujo de texto)"""
+    if isinstance(archivo, (bytes, bytearray)):
+        archivo = io.StringIO(archivo.decode('utf-8-sig'))
+    elif isinstance(archivo, str):
+        with open(archivo, newline='', encoding='utf-8-sig') as f:
+            return importar_contactos(list(csv.DictReader(f)), lote)
+    return importar_contactos(list(csv.DictReader(archivo)), lote)
+
+def reporte_csv(reporte):
+    salida = io.StringIO()
+    writer = csv.DictWriter(salida, fieldnames=COLUMNAS_REPORTE)
+    writer.writeheader()
+    writer.writerows(reporte)
+    return salida.getvalue()
+
+# =============================================
+# LÍNEA DE COMANDOS
+# =============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Importación masiva de contactos desde CSV')
+    parser.add_argument('archivo', help='CSV con columnas nombre, numero y opcionalmente tipo, operadora, departamento')
+    parser.add_argument('--reporte', help='Ruta del CSV de reporte por fila (por defecto se imprimen los rechazos)')
+    parser.add_argument('--lote', type=int, default=LOTE_INSERCION)
+    args = parser.parse_args()
+
+    insertados, reporte = importar_csv(args.archivo, args.lote)
+    if args.reporte:
+        with open(args.reporte, 'w', newline='', encoding='utf-8') as f:
+            f.write(reporte_csv(reporte))
+    else:
+        for r in reporte:
+            if r['estado'] == 'rechazado':
+                print(f"Fila {r['fila']}: {r['numero']} - {r['motivo']}")
+    raise SystemExit(0 if insertados == len(reporte) else 1)
+
+if __name__ == '__main__':
+    main()
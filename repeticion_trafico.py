@@ -0,0 +1,245 @@
+import json
+import time
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Solo se permite repetir tráfico contra instancias locales salvo que se indique lo contrario
+HOSTS_LOCALES = {'localhost', '127.0.0.1', '::1'}
+
+PERCENTILES = (50, 95, 99)
+
+# =============================================
+# REPETICIÓN
+# =============================================
+
+class _SinRedireccion(urllib.request.HTTPRedirectHandler):
+    # Se mide solo la petición grabada, no la página a la que redirige
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class SesionVirtual:
+    """Usuario virtual con su propio cookie jar; inicia sesión con las credenciales de prueba"""
+
+    def __init__(self, objetivo, usuario, password, timeout):
+        self.objetivo = objetivo.rstrip('/')
+        self.usuario = usuario
+        self.password = password
+        self.timeout = timeout
+        self.autenticada = False
+        self.lock = threading.Lock()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SinRedireccion())
+
+    def enviar(self, metodo, path, parametros=None):
+        datos = urllib.parse.urlencode(parametros or {}).encode() if metodo == 'POST' else None
+        req = urllib.request.Request(self.objetivo + path, data=datos, method=metodo)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                resp.read()
+                return resp.status, resp.headers.get('Location')
+        except urllib.error.HTTPError as e:
+            # Con las redirecciones desactivadas los 30x también llegan como HTTPError
+            e.read()
+            return e.code, e.headers.get('Location')
+
+    def asegurar_login(self):
+        with self.lock:
+            if not self.autenticada:
+                status, location = self.enviar('POST', '/login',
+                                               {'username': self.usuario, 'password': self.password})
+                self.autenticada = status == 302 and not (location or '').rstrip('/').endswith('/login')
+
+def _es_error(traza, status, location):
+    if status is None or status >= 500:
+        return True
+    # Una ruta protegida que redirige a /login perdió la sesión
+    if traza['ruta'] != '/login' and (location or '').rstrip('/').endswith('/login'):
+        return True
+    return status >= 400
+
+def cargar_trazas(ruta, rutas=None):
+    trazas = []
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                traza = json.loads(linea)
+                if not rutas or traza['ruta'] in rutas:
+                    trazas.append(traza)
+    trazas.sort(key=lambda t: t['ts'])
+    return trazas
+
+def repetir(trazas, objetivo, usuario, password, concurrencia=10, aceleracion=1.0, timeout=30):
+    """Reproduce las trazas respetando su espaciado (dividido por `aceleracion`; 0 = sin esperas)"""
+    sesiones = {}
+    resultados = []
+    lock_resultados = threading.Lock()
+
+    def ejecutar(traza, programado):
+        sesion = sesiones.setdefault(traza['sesion'], SesionVirtual(objetivo, usuario, password, timeout))
+        parametros = dict(traza['parametros'])
+        login = 0.0
+        if traza['ruta'] == '/login':
+            # Las credenciales reales nunca se graban: se usan las de prueba
+            parametros.update(username=usuario, password=password)
+        elif traza['sesion'] != 'anonimo':
+            inicio_login = time.perf_counter()
+            sesion.asegurar_login()
+            login = time.perf_counter() - inicio_login
+
+        try:
+            status, location = sesion.enviar(traza['metodo'], traza['path'], parametros)
+        except Exception:
+            status, location = None, None
+        # Desde la hora programada y no desde que el hilo la toma: la espera por un hilo libre
+        # cuando el servidor va lento es parte de la latencia (coordinated omission). El login
+        # de la sesión virtual no existía en la captura y se descuenta.
+        latencia = (time.perf_counter() - programado - login) * 1000
+        if traza['ruta'] == '/login' and status == 302:
+            sesion.autenticada = not (location or '').rstrip('/').endswith('/login')
+
+        with lock_resultados:
+            resultados.append({
+                'ruta': traza['ruta'],
+                'status': status,
+                'latencia_ms': latencia,
+                'error': _es_error(traza, status, location),
+            })
+
+    if not trazas:
+        return resultados, 0.0
+
+    t0 = trazas[0]['ts']
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        for traza in trazas:
+            if aceleracion:
+                programado = inicio + (traza['ts'] - t0) / aceleracion
+                espera = programado - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+            else:
+                programado = time.perf_counter()
+            pool.submit(ejecutar, traza, programado)
+    return resultados, time.perf_counter() - inicio
+
+# =============================================
+# REPORTE Y COMPARACIÓN
+# =============================================
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+def resumir(resultados, segundos):
+    def metricas(grupo):
+        latencias = sorted(r['latencia_ms'] for r in grupo)
+        errores = sum(1 for r in grupo if r['error'])
+        m = {
+            'peticiones': len(grupo),
+            'errores': errores,
+            'tasa_error': round(errores / len(grupo), 4) if grupo else 0.0,
+            'rps': round(len(grupo) / segundos, 2) if segundos else 0.0,
+        }
+        for p in PERCENTILES:
+            m[f"p{p}_ms"] = round(_percentil(latencias, p), 2)
+        return m
+
+    por_ruta = {}
+    for r in resultados:
+        por_ruta.setdefault(r['ruta'], []).append(r)
+    return {
+        'segundos': round(segundos, 3),
+        'total': metricas(resultados),
+        'rutas': {ruta: metricas(grupo) for ruta, grupo in sorted(por_ruta.items())},
+    }
+
+def imprimir_resumen(resumen):
+    print(f"{'Ruta':<24}{'Pet.':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'Error %':>9}")
+    filas = list(resumen['rutas'].items()) + [('TOTAL', resumen['total'])]
+    for ruta, m in filas:
+        print(f"{ruta:<24}{m['peticiones']:>8}{m['rps']:>9}{m['p50_ms']:>9}{m['p95_ms']:>9}"
+              f"{m['p99_ms']:>9}{m['tasa_error'] * 100:>8.2f}%")
+
+def comparar(base, nueva, umbral=0.10):
+    """Compara dos resúmenes; devuelve la lista de regresiones (p95/p99 o tasa de error)"""
+    regresiones = []
+    print(f"{'Ruta':<24}{'p95 base':>10}{'p95 nuevo':>11}{'Δ':>8}{'p99 Δ':>8}{'Error base':>12}{'Error nuevo':>12}")
+    for ruta in sorted(set(base['rutas']) | set(nueva['rutas'])):
+        b, n = base['rutas'].get(ruta), nueva['rutas'].get(ruta)
+        if not b or not n:
+            print(f"{ruta:<24} solo en {'la nueva' if n else 'la base'} ejecución")
+            continue
+        deltas = {}
+        for p in ('p95_ms', 'p99_ms'):
+            deltas[p] = (n[p] - b[p]) / b[p] if b[p] else 0.0
+            if deltas[p] > umbral:
+                regresiones.append(f"{ruta}: {p} {b[p]} -> {n[p]} ms (+{deltas[p] * 100:.1f}%)")
+        if n['tasa_error'] > b['tasa_error']:
+            regresiones.append(f"{ruta}: tasa de error {b['tasa_error']:.2%} -> {n['tasa_error']:.2%}")
+        print(f"{ruta:<24}{b['p95_ms']:>10}{n['p95_ms']:>11}{deltas['p95_ms'] * 100:>7.1f}%"
+              f"{deltas['p99_ms'] * 100:>7.1f}%{b['tasa_error']:>12.2%}{n['tasa_error']:>12.2%}")
+    return regresiones
+
+# =============================================
+# LÍNEA DE COMANDOS
+# =============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Repetición de tráfico grabado y comparación de ejecuciones')
+    sub = parser.add_subparsers(dest='accion', required=True)
+
+    rep = sub.add_parser('repetir', help='Reproducir trazas contra una instancia local')
+    rep.add_argument('trazas', help='Archivo JSONL grabado con CAPTURA_TRAFICO')
+    rep.add_argument('--objetivo', default='http://127.0.0.1:5000',
+                     help='Instancia local, arrancada con DB_SERVER apuntando a la base de prueba')
+    rep.add_argument('--usuario', required=True, help='Usuario de prueba (admin para /facturacion/generar)')
+    rep.add_argument('--password', required=True)
+    rep.add_argument('--concurrencia', type=int, default=10)
+    rep.add_argument('--aceleracion', type=float, default=1.0, help='Factor de aceleración; 0 = sin esperas')
+    rep.add_argument('--ruta', action='append', help='Limitar a estas rutas (repetible)')
+    rep.add_argument('--salida', help='Guardar el resumen JSON para compararlo después')
+    rep.add_argument('--permitir-remoto', action='store_true',
+                     help='Permitir un objetivo que no sea localhost (nunca producción)')
+
+    comp = sub.add_parser('comparar', help='Comparar dos resúmenes guardados con --salida')
+    comp.add_argument('base')
+    comp.add_argument('nueva')
+    comp.add_argument('--umbral', type=float, default=0.10, help='Regresión tolerada en p95/p99 (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    if args.accion == 'repetir':
+        host = urllib.parse.urlparse(args.objetivo).hostname
+        if host not in HOSTS_LOCALES and not args.permitir_remoto:
+            parser.error(f"El objetivo {host} no es local; use --permitir-remoto si es intencional")
+        trazas = cargar_trazas(args.trazas, args.ruta)
+        print(f"🔁 Repitiendo {len(trazas)} peticiones contra {args.objetivo} "
+              f"(concurrencia {args.concurrencia}, aceleración x{args.aceleracion:g})")
+        resultados, segundos = repetir(trazas, args.objetivo, args.usuario, args.password,
+                                       args.concurrencia, args.aceleracion)
+        resumen = resumir(resultados, segundos)
+        imprimir_resumen(resumen)
+        if args.salida:
+            with open(args.salida, 'w', encoding='utf-8') as f:
+                json.dump(resumen, f, ensure_ascii=False, indent=2)
+        raise SystemExit(0)
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nueva, encoding='utf-8') as f:
+        nueva = json.load(f)
+    regresiones = comparar(base, nueva, args.umbral)
+    if regresiones:
+        print("❌ Regresiones detectadas:")
+        for r in regresiones:
+            print(f"   {r}")
+        raise SystemExit(1)
+    print("✅ Sin regresiones")
+
+if __name__ == '__main__':
+    main()
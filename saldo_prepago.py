@@ -0,0 +1,434 @@
+import time
+import atexit
+import random
+import argparse
+import threading
+from decimal import Decimal
+from itertools import count
+
+from config.database import db
+from tarificacion import (determinar_tipo_destino, calcular_pulsos,
+                          DURACION_PULSO_DEFECTO, REDONDEO_DEFECTO)
+
+# Pulsos reservados por autorización cuando no se indica la duración esperada
+PULSOS_RESERVA = 5
+
+# Segundos entre checkpoints del libro hacia la base de datos
+INTERVALO_CHECKPOINT = 30
+
+# Reservas sin confirmar más antiguas que esto se liberan en el checkpoint (llamadas perdidas)
+RESERVA_MAXIMA_SEGUNDOS = 4 * 3600
+
+# Costo por pulso cuando no hay tarifa para el par origen/destino (igual que calcular_costo_con_pulsos)
+COSTO_PULSO_DEFECTO = Decimal('0.05')
+
+CERO = Decimal('0')
+
+# Los contactos prepago pagan por adelantado al descontarse el saldo: su consumo no se factura
+EXCLUIR_PREPAGO = "contacto_origen_id NOT IN (SELECT contacto_id FROM saldos_prepago WHERE modalidad = 'prepago')"
+
+class Cuenta:
+    """Saldo en memoria de un contacto prepago o con límite de crédito"""
+
+    __slots__ = ('contacto_id', 'modalidad', 'saldo', 'limite_credito', 'reservado',
+                 'reservas', 'consumo_pendiente', 'lock')
+
+    def __init__(self, contacto_id, modalidad, saldo, limite_credito):
+        self.contacto_id = contacto_id
+        self.modalidad = modalidad
+        self.saldo = Decimal(saldo)
+        self.limite_credito = Decimal(limite_credito) if modalidad == 'credito' else CERO
+        self.reservado = CERO
+        self.reservas = {}
+        # Consumo cobrado en memoria que todavía no se escribió en saldos_prepago
+        self.consumo_pendiente = CERO
+        self.lock = threading.Lock()
+
+    @property
+    def disponible(self):
+        return self.saldo + self.limite_credito - self.reservado
+
+class LibroSaldos:
+    """Libro de saldos en memoria con reserva/confirmación por llamada.
+
+    Cada cuenta tiene su propio lock, así que llamadas de contactos distintos no compiten
+    entre sí; el lock global solo se usa para recargar el libro completo.
+    """
+
+    def __init__(self):
+        self.cuentas = {}
+        self.tarifas = {}
+        self.duracion_pulso = DURACION_PULSO_DEFECTO
+        self.redondeo = REDONDEO_DEFECTO
+        self.cargado = False
+        self._lock = threading.Lock()
+        self._secuencia = count(1)
+        self._detener = threading.Event()
+        self._hilo = None
+        self._atexit = False
+
+    # ---------------------------------------------
+    # Carga y checkpoint
+    # ---------------------------------------------
+
+    def aplicar(self, saldos, tarifas, config_pulso=None):
+        """Reemplaza cuentas, tarifas y pulso a partir de filas ya leídas (de SQL o de prueba)"""
+        with self._lock:
+            if config_pulso:
+                self.duracion_pulso = config_pulso['duracion_pulso_segundos']
+                self.redondeo = bool(config_pulso['redondeo_pulso'])
+
+            nuevas = {}
+            for tarifa in tarifas:
+                nuevas.setdefault((tarifa['tipo_origen'], tarifa['tipo_destino']), Decimal(tarifa['costo_minuto']))
+            self.tarifas = nuevas
+
+            vigentes = set()
+            for fila in saldos:
+                contacto_id = fila['contacto_id']
+                vigentes.add(contacto_id)
+                cuenta = self.cuentas.get(contacto_id)
+                if cuenta is None:
+                    self.cuentas[contacto_id] = Cuenta(contacto_id, fila['modalidad'],
+                                                       fila['saldo'], fila['limite_credito'])
+                    continue
+                with cuenta.lock:
+                    # El saldo de la base ya no incluye el consumo aún no escrito
+                    cuenta.modalidad = fila['modalidad']
+                    cuenta.saldo = Decimal(fila['saldo']) - cuenta.consumo_pendiente
+                    cuenta.limite_credito = Decimal(fila['limite_credito']) if fila['modalidad'] == 'credito' else CERO
+
+            # Cuentas borradas de saldos_prepago pasan a pospago; las que tienen llamadas en curso
+            # o consumo sin escribir se quitan en una recarga posterior
+            for contacto_id, cuenta in list(self.cuentas.items()):
+                if contacto_id not in vigentes:
+                    with cuenta.lock:
+                        if not cuenta.reservas and not cuenta.consumo_pendiente:
+                            del self.cuentas[contacto_id]
+            self.cargado = True
+
+    def cargar(self):
+        """Lee saldos, tarifas y configuración de pulsos desde la base de datos"""
+        saldos = db.execute_query(
+            "SELECT contacto_id, modalidad, saldo, limite_credito FROM saldos_prepago"
+        )
+        if saldos is None:
+            print("❌ No se pudo cargar el libro de saldos")
+            return False
+        tarifas = db.execute_query("SELECT tipo_origen, tipo_destino, costo_minuto FROM tarifas ORDER BY id") or []
+        config_pulso = db.execute_query("SELECT TOP 1 * FROM configuracion_pulsos ORDER BY id DESC")
+        self.aplicar(saldos, tarifas, config_pulso[0] if config_pulso else None)
+        print(f"💳 Libro de saldos cargado: {len(self.cuentas)} cuentas prepago/crédito")
+        return True
+
+    def checkpoint(self):
+        """Escribe en saldos_prepago el consumo acumulado desde el último checkpoint"""
+        deltas = []
+        limite = time.monotonic() - RESERVA_MAXIMA_SEGUNDOS
+        for cuenta in list(self.cuentas.values()):
+            with cuenta.lock:
+                for reserva_id, (monto, _, creada) in list(cuenta.reservas.items()):
+                    if creada < limite:
+                        del cuenta.reservas[reserva_id]
+                        cuenta.reservado -= monto
+                if cuenta.consumo_pendiente:
+                    deltas.append((cuenta, cuenta.consumo_pendiente))
+                    cuenta.consumo_pendiente = CERO
+        if not deltas:
+            return 0
+
+        conn = db.get_connection()
+        try:
+            if not conn:
+                raise RuntimeError("sin conexión")
+            cursor = conn.cursor()
+            # Se escribe el delta y no el saldo absoluto para no pisar recargas hechas en la base
+            cursor.executemany("""
+                UPDATE saldos_prepago
+                SET saldo = saldo - ?, fecha_actualizacion = GETDATE()
+                WHERE contacto_id = ?
+            """, [(delta, cuenta.contacto_id) for cuenta, delta in deltas])
+            conn.commit()
+        except Exception as e:
+            print(f"❌ Error en checkpoint de saldos: {e}")
+            for cuenta, delta in deltas:
+                with cuenta.lock:
+                    cuenta.consumo_pendiente += delta
+            return None
+        finally:
+            if conn:
+                conn.close()
+        return len(deltas)
+
+    def recargar_cuenta(self, contacto_id):
+        """Vuelve a leer el saldo de una cuenta (tras un pago) sin recargar el libro completo"""
+        cuenta = self.cuentas.get(contacto_id)
+        if cuenta is None:
+            return False
+        fila = db.execute_query("SELECT saldo FROM saldos_prepago WHERE contacto_id = ?", (contacto_id,))
+        if not fila:
+            return False
+        with cuenta.lock:
+            cuenta.saldo = Decimal(fila[0]['saldo']) - cuenta.consumo_pendiente
+        return True
+
+    def iniciar(self, intervalo=INTERVALO_CHECKPOINT):
+        """Arranca el hilo de checkpoint periódico (también refresca saldos y tarifas)"""
+        if self._hilo and self._hilo.is_alive():
+            return
+
+        def ciclo():
+            while not self._detener.wait(intervalo):
+                if self.checkpoint() is not None:
+                    self.cargar()
+
+        self._detener.clear()
+        self._hilo = threading.Thread(target=ciclo, name='checkpoint-saldos', daemon=True)
+        self._hilo.start()
+        # El hilo es daemon: sin esto, el consumo desde el último checkpoint se pierde al reiniciar
+        if not self._atexit:
+            atexit.register(self.detener)
+            self._atexit = True
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join()
+        self.checkpoint()
+
+    # ---------------------------------------------
+    # Tarificación en línea
+    # ---------------------------------------------
+
+    def costo_pulso(self, numero_origen, numero_destino):
+        clave = (determinar_tipo_destino(numero_origen), determinar_tipo_destino(numero_destino))
+        return self.tarifas.get(clave, COSTO_PULSO_DEFECTO)
+
+    def autorizar(self, contacto_id, numero_origen, numero_destino, segundos=None):
+        """Reserva saldo antes de la llamada.
+
+        Devuelve un diccionario con 'autorizado', 'reserva_id' y 'segundos_autorizados'. Los
+        contactos sin cuenta prepago/crédito son pospago y se autorizan sin reserva. Si el libro
+        no se pudo cargar se rechaza: no se sabe quién es pospago y un prepago no se cobraría.
+        """
+        if not self.cargado:
+            return {'autorizado': False, 'reserva_id': None, 'segundos_autorizados': 0,
+                    'modalidad': None, 'motivo': 'Libro de saldos no disponible'}
+        cuenta = self.cuentas.get(contacto_id)
+        if cuenta is None:
+            return {'autorizado': True, 'reserva_id': None, 'segundos_autorizados': segundos,
+                    'modalidad': 'pospago'}
+
+        costo_pulso = self.costo_pulso(numero_origen, numero_destino)
+        if segundos is None:
+            solicitados = PULSOS_RESERVA
+        else:
+            solicitados = max(1, calcular_pulsos(segundos, self.duracion_pulso, True))
+
+        with cuenta.lock:
+            if costo_pulso > 0:
+                alcanzan = int(max(cuenta.disponible, CERO) // costo_pulso)
+                pulsos = min(solicitados, alcanzan)
+            else:
+                pulsos = solicitados
+            if pulsos <= 0:
+                return {'autorizado': False, 'reserva_id': None, 'segundos_autorizados': 0,
+                        'modalidad': cuenta.modalidad, 'motivo': 'Saldo insuficiente'}
+            monto = costo_pulso * pulsos
+            reserva_id = f"{contacto_id}-{next(self._secuencia)}"
+            cuenta.reservas[reserva_id] = (monto, costo_pulso, time.monotonic())
+            cuenta.reservado += monto
+
+        segundos_autorizados = pulsos * self.duracion_pulso
+        if segundos is not None:
+            segundos_autorizados = min(segundos, segundos_autorizados)
+        return {'autorizado': True, 'reserva_id': reserva_id, 'segundos_autorizados': segundos_autorizados,
+                'modalidad': cuenta.modalidad}
+
+    def _cuenta_reserva(self, reserva_id):
+        # El id de reserva empieza con el contacto, así no hace falta un índice global con lock
+        return self.cuentas.get(int(reserva_id.split('-', 1)[0]))
+
+    def confirmar(self, reserva_id, duracion_segundos):
+        """Cobra los pulsos realmente consumidos al colgar y libera la reserva; devuelve el cargo"""
+        if reserva_id is None:
+            return CERO
+        cuenta = self._cuenta_reserva(reserva_id)
+        if cuenta is None:
+            return None
+        pulsos = calcular_pulsos(duracion_segundos, self.duracion_pulso, self.redondeo)
+        with cuenta.lock:
+            reserva = cuenta.reservas.pop(reserva_id, None)
+            if reserva is None:
+                return None
+            monto_reservado, costo_pulso, _ = reserva
+            cargo = costo_pulso * pulsos
+            cuenta.reservado -= monto_reservado
+            cuenta.saldo -= cargo
+            cuenta.consumo_pendiente += cargo
+        return cargo
+
+    def liberar(self, reserva_id):
+        """Cancela una reserva sin cobrar (llamada no completada)"""
+        cuenta = self._cuenta_reserva(reserva_id) if reserva_id else None
+        if cuenta is None:
+            return False
+        with cuenta.lock:
+            reserva = cuenta.reservas.pop(reserva_id, None)
+            if reserva is None:
+                return False
+            cuenta.reservado -= reserva[0]
+        return True
+
+    def saldo(self, contacto_id):
+        cuenta = self.cuentas.get(contacto_id)
+        if cuenta is None:
+            return None
+        with cuenta.lock:
+            return {'modalidad': cuenta.modalidad, 'saldo': cuenta.saldo,
+                    'reservado': cuenta.reservado, 'disponible': cuenta.disponible}
+
+# Instancia global del libro de saldos (se carga al primer uso)
+libro = LibroSaldos()
+_lock_carga = threading.Lock()
+
+def obtener_libro():
+    if not libro.cargado:
+        with _lock_carga:
+            if not libro.cargado and libro.cargar():
+                libro.iniciar()
+    return libro
+
+def contactos_prepago():
+    """Ids de los contactos prepago (None si no se pudo leer)"""
+    filas = db.execute_query("SELECT contacto_id FROM saldos_prepago WHERE modalidad = 'prepago'")
+    return None if filas is None else {f['contacto_id'] for f in filas}
+
+def pagar_factura(factura_id):
+    """Marca una factura como pagada y salda la cuenta si el contacto es de crédito.
+
+    El consumo de una cuenta de crédito se descuenta del saldo al colgar y se cobra en la
+    factura del periodo; al pagarla el saldo recupera el total facturado. Devuelve el monto
+    repuesto (0 para pospago) o None si la factura no existe o ya estaba pagada.
+    """
+    conn = db.get_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        # El cambio de estado y el abono van en la misma transacción: un pago no se abona dos veces
+        cursor.execute("""
+            UPDATE facturas SET estado = 'pagada'
+            OUTPUT inserted.contacto_id, inserted.total
+            WHERE id = ? AND ISNULL(estado, '') <> 'pagada'
+        """, (factura_id,))
+        factura = cursor.fetchone()
+        if factura is None:
+            conn.rollback()
+            return None
+        contacto_id, total = factura
+        cursor.execute("""
+            UPDATE saldos_prepago
+            SET saldo = saldo + ?, fecha_actualizacion = GETDATE()
+            WHERE contacto_id = ? AND modalidad = 'credito'
+        """, (total, contacto_id))
+        repuesto = Decimal(total) if cursor.rowcount else CERO
+        conn.commit()
+        # Escritura con conexión propia: marcar la sesión para que sus lecturas vayan al primario
+        db._registrar_escritura()
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error al pagar la factura {factura_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+    if repuesto and libro.cargado:
+        libro.recargar_cuenta(contacto_id)
+    return repuesto
+
+# =============================================
+# BENCHMARK
+# =============================================
+
+def _percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+def benchmark(hilos=16, operaciones=20000, contactos=1000, segundos_llamada=180):
+    """Mide la latencia de autorizar/confirmar con hilos concurrentes sobre un libro en memoria"""
+    libro_prueba = LibroSaldos()
+    libro_prueba.aplicar(
+        [{'contacto_id': i, 'modalidad': 'prepago' if i % 2 else 'credito',
+          'saldo': Decimal('1000000'), 'limite_credito': Decimal('500')} for i in range(1, contactos + 1)],
+        [{'tipo_origen': o, 'tipo_destino': d, 'costo_minuto': Decimal(c)}
+         for o in ('celular', 'convencional')
+         for d, c in (('celular', '0.08'), ('convencional', '0.02'), ('internacional', '0.50'))],
+    )
+    destinos = ['88887777', '22223333', '+50212345678']
+    latencias_autorizar = []
+    latencias_confirmar = []
+    lock_resultados = threading.Lock()
+    inicio_comun = threading.Barrier(hilos)
+
+    def trabajador(semilla):
+        rnd = random.Random(semilla)
+        propias_a, propias_c = [], []
+        inicio_comun.wait()
+        for _ in range(operaciones // hilos):
+            contacto_id = rnd.randint(1, contactos)
+            t0 = time.perf_counter()
+            autorizacion = libro_prueba.autorizar(contacto_id, '88881111', rnd.choice(destinos), segundos_llamada)
+            t1 = time.perf_counter()
+            libro_prueba.confirmar(autorizacion['reserva_id'], rnd.randint(1, segundos_llamada))
+            t2 = time.perf_counter()
+            propias_a.append(t1 - t0)
+            propias_c.append(t2 - t1)
+        with lock_resultados:
+            latencias_autorizar.extend(propias_a)
+            latencias_confirmar.extend(propias_c)
+
+    hilos_lista = [threading.Thread(target=trabajador, args=(i,)) for i in range(hilos)]
+    t_inicio = time.perf_counter()
+    for h in hilos_lista:
+        h.start()
+    for h in hilos_lista:
+        h.join()
+    total = time.perf_counter() - t_inicio
+
+    resultado = {'hilos': hilos, 'operaciones': len(latencias_autorizar),
+                 'operaciones_por_segundo': round(len(latencias_autorizar) / total)}
+    for nombre, valores in (('autorizar', latencias_autorizar), ('confirmar', latencias_confirmar)):
+        valores.sort()
+        resultado[nombre] = {f"p{p}_us": round(_percentil(valores, p) * 1e6, 1) for p in (50, 95, 99)}
+        resultado[nombre]['max_us'] = round(valores[-1] * 1e6, 1)
+    return resultado
+
+# =============================================
+# LÍNEA DE COMANDOS
+# =============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Libro de saldos prepago/crédito')
+    sub = parser.add_subparsers(dest='accion', required=True)
+    bench = sub.add_parser('benchmark', help='Medir la latencia de autorización bajo concurrencia')
+    bench.add_argument('--hilos', type=int, default=16)
+    bench.add_argument('--operaciones', type=int, default=20000)
+    bench.add_argument('--contactos', type=int, default=1000)
+    consulta = sub.add_parser('saldo', help='Consultar el saldo en memoria de un contacto')
+    consulta.add_argument('contacto_id', type=int)
+    args = parser.parse_args()
+
+    if args.accion == 'benchmark':
+        r = benchmark(args.hilos, args.operaciones, args.contactos)
+        print(f"⏱️ {r['operaciones']} llamadas con {r['hilos']} hilos ({r['operaciones_por_segundo']} ops/s)")
+        for nombre in ('autorizar', 'confirmar'):
+            m = r[nombre]
+            print(f"   {nombre:<10} p50 {m['p50_us']}µs  p95 {m['p95_us']}µs  p99 {m['p99_us']}µs  max {m['max_us']}µs")
+        raise SystemExit(0 if r['autorizar']['p99_us'] < 1000 else 1)
+
+    if not libro.cargar():
+        raise SystemExit(1)
+    print(libro.saldo(args.contacto_id) or "Contacto pospago (sin cuenta prepago/crédito)")
+
+if __name__ == '__main__':
+    main()
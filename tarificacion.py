@@ -0,0 +1,37 @@
+# =============================================
+# REGLAS DE TARIFICACIÓN COMPARTIDAS
+# =============================================
+
+# Valores por defecto cuando no hay configuracion_pulsos
+DURACION_PULSO_DEFECTO = 60
+REDONDEO_DEFECTO = True
+
+# Función para determinar tipo de destino
+def determinar_tipo_destino(numero_destino):
+    if not numero_destino:
+        return 'convencional'
+    
+    numero_limpio = str(numero_destino).strip()
+    
+    # Internacional
+    if numero_limpio.startswith('+'):
+        return 'internacional'
+    
+    # Celular (8 dígitos que empiezan con 5,7,8)
+    if len(numero_limpio) == 8 and numero_limpio[0] in ['5', '7', '8']:
+        return 'celular'
+    
+    # Convencional (8 dígitos que no empiezan con 5,7,8)
+    if len(numero_limpio) == 8:
+        return 'convencional'
+    
+    # Por defecto
+    return 'convencional'
+
+# Función para calcular el número de pulsos consumidos
+def calcular_pulsos(duracion_segundos, duracion_pulso=DURACION_PULSO_DEFECTO, redondeo=REDONDEO_DEFECTO):
+    if redondeo:
+        # Redondear hacia arriba (ej: 61 segundos = 2 pulsos)
+        return (duracion_segundos + duracion_pulso - 1) // duracion_pulso
+    # Redondear hacia abajo
+    return duracion_segundos // duracion_pulso